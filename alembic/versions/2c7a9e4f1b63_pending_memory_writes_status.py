@@ -0,0 +1,30 @@
+"""Pending memory writes status
+
+Revision ID: 2c7a9e4f1b63
+Revises: 9b3e6f1d4c28
+Create Date: 2026-10-18 18:12:35.904417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c7a9e4f1b63'
+down_revision: Union[str, None] = '9b3e6f1d4c28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Записи, исчерпавшие попытки, помечаются dead вместо удаления
+    op.add_column(
+        'pending_memory_writes',
+        sa.Column('status', sa.String(), server_default='pending', nullable=False)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('pending_memory_writes', 'status')
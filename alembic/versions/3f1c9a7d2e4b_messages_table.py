@@ -0,0 +1,56 @@
+"""Messages table
+
+Revision ID: 3f1c9a7d2e4b
+Revises: bb900e2ff84e
+Create Date: 2026-10-18 10:12:03.114502
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2e4b'
+down_revision: Union[str, None] = 'bb900e2ff84e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('messages',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_messages_user_id_created_at', 'messages', ['user_id', 'created_at'], unique=False)
+
+    # Перенос истории из JSON-массивов message_histories.
+    # Приложение записывало в JSONB строку с json.dumps, поэтому такие значения
+    # сначала раскрываются до массива.
+    op.execute("""
+        INSERT INTO messages (user_id, role, content, created_at)
+        SELECT
+            mh.user_id,
+            COALESCE(e.elem->>'role', 'human'),
+            COALESCE(e.elem->>'content', ''),
+            COALESCE((e.elem->>'timestamp')::timestamp, mh.created_at, now())
+        FROM message_histories mh
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE
+                WHEN jsonb_typeof(mh.messages) = 'string' THEN (mh.messages #>> '{}')::jsonb
+                ELSE mh.messages
+            END
+        ) WITH ORDINALITY AS e(elem, ord)
+        ORDER BY mh.user_id, mh.id, e.ord
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_user_id_created_at', table_name='messages')
+    op.drop_table('messages')
@@ -0,0 +1,41 @@
+"""Pending memory writes
+
+Revision ID: 5d8f2c6a0b17
+Revises: e4b7a1c2d9f0
+Create Date: 2026-10-18 14:31:09.215530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8f2c6a0b17'
+down_revision: Union[str, None] = 'e4b7a1c2d9f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('pending_memory_writes',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_pending_memory_writes_user_id_id', 'pending_memory_writes', ['user_id', 'id'], unique=False)
+    op.create_index(op.f('ix_pending_memory_writes_next_attempt_at'), 'pending_memory_writes', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_pending_memory_writes_next_attempt_at'), table_name='pending_memory_writes')
+    op.drop_index('ix_pending_memory_writes_user_id_id', table_name='pending_memory_writes')
+    op.drop_table('pending_memory_writes')
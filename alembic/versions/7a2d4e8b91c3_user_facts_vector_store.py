@@ -0,0 +1,45 @@
+"""User facts vector store
+
+Revision ID: 7a2d4e8b91c3
+Revises: 3f1c9a7d2e4b
+Create Date: 2026-10-18 11:02:47.520163
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import Config
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a2d4e8b91c3'
+down_revision: Union[str, None] = '3f1c9a7d2e4b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Раньше таблица пересоздавалась приложением при каждом старте,
+    # поэтому на существующих базах она уже есть и остаётся как есть
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.user_facts_vector_store (
+            langchain_id UUID PRIMARY KEY,
+            content TEXT NOT NULL,
+            embedding vector({Config.EMBEDDING_DIMENSIONS}) NOT NULL,
+            langchain_metadata JSON
+        )
+    """)
+    # Параметры индекса берутся из конфигурации; для смены параметров
+    # на работающей базе используется python -m app.admin vector-index --rebuild
+    if Config.VECTOR_INDEX_TYPE == "ivfflat":
+        options = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {Config.IVFFLAT_LISTS})"
+    else:
+        options = f"hnsw (embedding vector_cosine_ops) WITH (m = {Config.HNSW_M}, ef_construction = {Config.HNSW_EF_CONSTRUCTION})"
+    op.execute(f"CREATE INDEX IF NOT EXISTS user_facts_vector_store_embedding_idx ON public.user_facts_vector_store USING {options}")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS public.user_facts_vector_store_embedding_idx")
@@ -0,0 +1,97 @@
+"""Core memories table
+
+Revision ID: 9b3e6f1d4c28
+Revises: 5d8f2c6a0b17
+Create Date: 2026-10-18 16:02:47.381920
+
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6f1d4c28'
+down_revision: Union[str, None] = '5d8f2c6a0b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def upgrade() -> None:
+    op.create_table('core_memories',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('token_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_core_memories_user_id_priority_updated_at', 'core_memories',
+        ['user_id', 'priority', 'updated_at'], unique=False
+    )
+
+    # Перенос фактов из JSON-списков memories.
+    # Приложение записывало в JSONB строку с json.dumps, поэтому такие значения
+    # сначала раскрываются до списка; значения, которые не удаётся разобрать как список,
+    # пропускаются с предупреждением. Список хранился от новых фактов к старым -
+    # порядок сохраняется через updated_at. token_count заполняет get_memories при первом чтении.
+    memories = sa.table(
+        'memories',
+        sa.column('id', sa.Integer()),
+        sa.column('user_id', sa.Integer()),
+        sa.column('facts', postgresql.JSONB()),
+        sa.column('created_at', sa.DateTime()),
+        sa.column('updated_at', sa.DateTime()),
+    )
+    core_memories = sa.table(
+        'core_memories',
+        sa.column('user_id', sa.Integer()),
+        sa.column('content', sa.Text()),
+        sa.column('priority', sa.Integer()),
+        sa.column('created_at', sa.DateTime()),
+        sa.column('updated_at', sa.DateTime()),
+    )
+    now = datetime.utcnow()
+    rows = []
+    result = op.get_bind().execute(sa.select(memories).order_by(memories.c.user_id, memories.c.id))
+    for memory in result:
+        facts = memory.facts
+        if isinstance(facts, str):
+            try:
+                facts = json.loads(facts)
+            except ValueError:
+                facts = None
+        if not isinstance(facts, list):
+            logger.warning("memories.id=%s: facts не является списком, строка пропущена.", memory.id)
+            continue
+        created_at = memory.created_at or now
+        updated_at = memory.updated_at or created_at
+        for position, fact in enumerate(facts, start=1):
+            content = fact if isinstance(fact, str) or fact is None else json.dumps(fact, ensure_ascii=False)
+            if not content:
+                continue
+            rows.append({
+                'user_id': memory.user_id,
+                'content': content,
+                'priority': 0,
+                'created_at': created_at,
+                'updated_at': updated_at - timedelta(milliseconds=position),
+            })
+    if rows:
+        op.bulk_insert(core_memories, rows)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_core_memories_user_id_priority_updated_at', table_name='core_memories')
+    op.drop_table('core_memories')
@@ -0,0 +1,39 @@
+"""User facts typed columns
+
+Revision ID: c51e0b7f3a96
+Revises: 7a2d4e8b91c3
+Create Date: 2026-10-18 12:20:31.804377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c51e0b7f3a96'
+down_revision: Union[str, None] = '7a2d4e8b91c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE public.user_facts_vector_store ADD COLUMN IF NOT EXISTS user_id INTEGER')
+    op.execute('ALTER TABLE public.user_facts_vector_store ADD COLUMN IF NOT EXISTS "timestamp" TEXT')
+    op.execute('ALTER TABLE public.user_facts_vector_store ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT now()')
+    # Перенос значений из JSON-метаданных в колонки
+    op.execute("""
+        UPDATE public.user_facts_vector_store
+        SET user_id = (langchain_metadata->>'user_id')::int,
+            "timestamp" = langchain_metadata->>'timestamp'
+        WHERE user_id IS NULL
+    """)
+    op.execute('CREATE INDEX IF NOT EXISTS ix_user_facts_vector_store_user_id ON public.user_facts_vector_store (user_id)')
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS public.ix_user_facts_vector_store_user_id')
+    op.execute('ALTER TABLE public.user_facts_vector_store DROP COLUMN IF EXISTS created_at')
+    op.execute('ALTER TABLE public.user_facts_vector_store DROP COLUMN IF EXISTS "timestamp"')
+    op.execute('ALTER TABLE public.user_facts_vector_store DROP COLUMN IF EXISTS user_id')
@@ -0,0 +1,76 @@
+# app/admin.py
+
+import argparse
+import asyncio
+import json
+import logging
+
+from .config import Config
+from .database import create_engine
+from .logging_config import setup_logging
+from .vectorstore import build_vector_index, bulk_add_recall_memories
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+def create_admin_engine():
+    # Построение индекса и импорт идут дольше обычного таймаута запросов
+    return create_engine(Config.PGVECTOR_URL or Config.DATABASE_URL, "admin", statement_timeout_ms=0)
+
+async def vector_index(rebuild: bool):
+    engine = create_admin_engine()
+    try:
+        await build_vector_index(rebuild=rebuild, engine=engine)
+    finally:
+        await engine.dispose()
+
+async def import_facts(path: str, batch_size: int):
+    """Импорт recall фактов из JSONL-файла со строками {"user_id": ..., "memory": ..., "timestamp": ...}."""
+    total = 0
+    batch = []
+    engine = create_admin_engine()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    total += await bulk_add_recall_memories(batch, engine=engine)
+                    logger.info("Импортировано %s фактов.", total)
+                    batch = []
+        if batch:
+            total += await bulk_add_recall_memories(batch, engine=engine)
+    finally:
+        await engine.dispose()
+    logger.info("Импорт завершён, всего %s фактов.", total)
+
+def main():
+    parser = argparse.ArgumentParser(description="Административные команды бота.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser(
+        "vector-index",
+        help="Построить ANN-индекс по эмбеддингам recall памяти с параметрами из конфигурации."
+    )
+    index_parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Удалить существующий индекс и построить заново (например, после смены HNSW_M или IVFFLAT_LISTS)."
+    )
+
+    import_parser = subparsers.add_parser(
+        "import-facts",
+        help="Пакетно загрузить recall факты из JSONL-файла."
+    )
+    import_parser.add_argument("path", help="Файл, каждая строка которого - {\"user_id\", \"memory\", \"timestamp\"}.")
+    import_parser.add_argument("--batch-size", type=int, default=5000, help="Сколько фактов обрабатывать за раз.")
+
+    args = parser.parse_args()
+    if args.command == "vector-index":
+        asyncio.run(vector_index(args.rebuild))
+    elif args.command == "import-facts":
+        asyncio.run(import_facts(args.path, args.batch_size))
+
+if __name__ == '__main__':
+    main()
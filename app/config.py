@@ -10,11 +10,138 @@ logger = logging.getLogger(__name__)
 
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+    # Логирование: уровень, формат (text или json), доля выводимых DEBUG-записей (0..1)
+    # и вывод содержимого сообщений и памяти (по умолчанию в логи попадает только размер)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    LOG_PAYLOADS = os.getenv('LOG_PAYLOADS', 'false').lower() == 'true'
+
+    # Режим получения обновлений: polling, webhook или sharded (входной процесс и несколько процессов-обработчиков)
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+    # Webhook: публичный адрес, путь и секрет, адрес сервера, число обработчиков и длина очереди обновлений.
+    # Обработчик только передаёт сообщение в очередь ходов, одновременные ходы ограничивает TURN_CONCURRENCY
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    WEBHOOK_SET_ON_STARTUP = os.getenv('WEBHOOK_SET_ON_STARTUP', 'true').lower() == 'true'
+    WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+    WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))
+    WEBHOOK_MAX_PENDING_UPDATES = int(os.getenv('WEBHOOK_MAX_PENDING_UPDATES', 100))
+
+    # Шардирование по процессам: число обработчиков, длина очереди к каждому и одновременных обновлений в нём.
+    # Обновление занимает слот только на время передачи сообщения в очередь ходов (см. TURN_CONCURRENCY)
+    SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))
+    SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', 100))
+    SHARD_WORKER_CONCURRENCY = int(os.getenv('SHARD_WORKER_CONCURRENCY', 16))
+    SHARD_POLLING_TIMEOUT = int(os.getenv('SHARD_POLLING_TIMEOUT', 30))
+
+    # Выгрузка метрик вне webhook-режима: HTTP-эндпоинт /metrics на METRICS_PORT (0 - выключен)
+    # и/или файл METRICS_FILE, перезаписываемый раз в METRICS_FILE_INTERVAL секунд.
+    # В многопроцессном режиме обработчик N использует порт METRICS_PORT + N + 1 и файл METRICS_FILE.N
+    METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+    METRICS_FILE = os.getenv('METRICS_FILE', '')
+    METRICS_FILE_INTERVAL = float(os.getenv('METRICS_FILE_INTERVAL', 15))
+
     DATABASE_URL = os.getenv('DATABASE_URL')
     SYNC_DATABASE_URL = os.getenv('SYNC_DATABASE_URL')
     PGVECTOR_URL = os.getenv('PGVECTOR_URL')
 
+    # Пул соединений с базой (общий для приложения и векторного хранилища, если URL совпадают)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # Таймаут выполнения запроса на стороне Postgres в миллисекундах (0 - без ограничения)
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_BASE_PROVIDER = os.getenv('OPENAI_BASE_PROVIDER')
 
+    LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-2024-11-20')
+    # HTTP-клиент к провайдеру: таймаут запроса в секундах, повторы и размеры пула соединений
+    LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+
+    # Потоковый ответ: сообщение в Telegram редактируется по мере генерации не чаще раза в STREAM_EDIT_INTERVAL секунд
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+
+    # Склейка серии сообщений: ждём паузу BURST_DEBOUNCE секунд, но не дольше BURST_MAX_WAIT с первого сообщения
+    BURST_DEBOUNCE = float(os.getenv('BURST_DEBOUNCE', 0.7))
+    BURST_MAX_WAIT = float(os.getenv('BURST_MAX_WAIT', 3.0))
+    # Сколько ходов разных пользователей выполняется одновременно в одном процессе;
+    # ожидающие своей очереди сообщения лимит не занимают
+    TURN_CONCURRENCY = int(os.getenv('TURN_CONCURRENCY', 16))
+
+    # Кэш пользователей по telegram_id: размер и период проверки имени пользователя в секундах
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 3600))
+
+    # Контекст диалога: сколько последних сообщений читать из базы
+    HISTORY_LIMIT = int(os.getenv('HISTORY_LIMIT', 20))
+    # Общий бюджет токенов на историю, recall и core память в промпте. История заполняет его первой,
+    # отдельного лимита токенов на историю нет
+    CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 4000))
+    # Сколько core фактов пользователя с наибольшим рангом показывать агенту (остальные хранятся, но не читаются)
+    CORE_MEMORY_MAX_FACTS = int(os.getenv('CORE_MEMORY_MAX_FACTS', 50))
+    TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')
+
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+    EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 1024))
+    # Пакетная запись фактов: текстов в одном запросе к эмбеддингам, параллельных запросов, строк в одном INSERT
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 256))
+    EMBEDDING_BATCH_CONCURRENCY = int(os.getenv('EMBEDDING_BATCH_CONCURRENCY', 2))
+    RECALL_INSERT_BATCH_SIZE = int(os.getenv('RECALL_INSERT_BATCH_SIZE', 1000))
+
+    # Кэш эмбеддингов: LRU в памяти процесса и опциональный уровень в Postgres
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 10000))
+    EMBEDDING_CACHE_PERSISTENT = os.getenv('EMBEDDING_CACHE_PERSISTENT', 'false').lower() == 'true'
+    EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', 200000))
+
+    # Создавать таблицу векторного хранилища при старте, если её нет (по умолчанию её создаёт миграция)
+    VECTORSTORE_CREATE_TABLE = os.getenv('VECTORSTORE_CREATE_TABLE', 'false').lower() == 'true'
+
+    # Прогрев при старте: сколько соединений с базой открыть заранее и собирать ли граф агента
+    # до приёма обновлений (иначе он собирается при первом ходе)
+    STARTUP_WARM_CONNECTIONS = int(os.getenv('STARTUP_WARM_CONNECTIONS', 2))
+    STARTUP_BUILD_GRAPHS = os.getenv('STARTUP_BUILD_GRAPHS', 'true').lower() == 'true'
+
+    # ANN-индекс по эмбеддингам recall памяти: hnsw или ivfflat
+    VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'hnsw')
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 64))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 40))
+    IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS', 100))
+    IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', 1))
+
+    # Выполнение инструментов агента: число одновременных вызовов и таймаут одного вызова в секундах
+    TOOL_CONCURRENCY = int(os.getenv('TOOL_CONCURRENCY', 4))
+    TOOL_TIMEOUT = float(os.getenv('TOOL_TIMEOUT', 30))
+
+    # Ограничения одного хода агента: итерации инструментов, вызовы LLM и общий дедлайн в секундах.
+    # При достижении любого из них агент даёт финальный ответ без вызова инструментов.
+    # Вызов LLM агента прерывается по дедлайну, финальный ответ ограничен ещё FINAL_ANSWER_TIMEOUT секундами
+    AGENT_MAX_TOOL_ITERATIONS = int(os.getenv('AGENT_MAX_TOOL_ITERATIONS', 3))
+    AGENT_MAX_LLM_CALLS = int(os.getenv('AGENT_MAX_LLM_CALLS', 4))
+    TURN_DEADLINE = float(os.getenv('TURN_DEADLINE', 45))
+    FINAL_ANSWER_TIMEOUT = float(os.getenv('FINAL_ANSWER_TIMEOUT', 10))
+
+    # Отложенная запись памяти: инструменты ставят запись в очередь и сразу отвечают агенту
+    MEMORY_WRITE_BEHIND = os.getenv('MEMORY_WRITE_BEHIND', 'true').lower() == 'true'
+    MEMORY_WRITE_FLUSH_INTERVAL = float(os.getenv('MEMORY_WRITE_FLUSH_INTERVAL', 1.0))
+    MEMORY_WRITE_BATCH_SIZE = int(os.getenv('MEMORY_WRITE_BATCH_SIZE', 100))
+    MEMORY_WRITE_MAX_ATTEMPTS = int(os.getenv('MEMORY_WRITE_MAX_ATTEMPTS', 10))
+    # Сколько пользователей применяются одновременно. Каждый держит соединение с advisory-блокировкой
+    # и берёт ещё одно на саму запись, поэтому значение должно быть заметно меньше DB_POOL_SIZE
+    MEMORY_WRITE_CONCURRENCY = int(os.getenv('MEMORY_WRITE_CONCURRENCY', max(1, DB_POOL_SIZE // 4)))
+
     logger.info("Конфигурация загружена успешно.")
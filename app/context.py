@@ -0,0 +1,46 @@
+# app/context.py
+
+import logging
+from typing import List, Tuple
+from .utils import count_tokens, trim_messages_to_budget
+
+logger = logging.getLogger(__name__)
+
+def _take_within_budget(items: List[str], budget: int) -> Tuple[List[str], int]:
+    """Берёт элементы по порядку, пока они помещаются в бюджет; возвращает их и потраченные токены."""
+    taken = []
+    used = 0
+    for item in items:
+        tokens = count_tokens(item)
+        if used + tokens > budget:
+            break
+        taken.append(item)
+        used += tokens
+    return taken, used
+
+def build_context(
+    history: List[dict],
+    recall_memories: List[str],
+    core_memories: List[str],
+    max_tokens: int,
+) -> Tuple[List[dict], List[str], List[str]]:
+    """Укладывает переменную часть промпта в бюджет max_tokens токенов.
+
+    Бюджет заполняется по приоритету: сначала последние сообщения истории (от новых к старым,
+    последнее сохраняется всегда, см. trim_messages_to_budget), затем recall память в порядке
+    релевантности, затем core память в порядке ранга. Всё, что не поместилось, отбрасывается.
+    """
+    kept_messages = trim_messages_to_budget(history, max_tokens)
+    used = sum(count_tokens(msg["content"]) for msg in kept_messages)
+
+    kept_recall, recall_tokens = _take_within_budget(recall_memories, max(0, max_tokens - used))
+    used += recall_tokens
+    kept_core, core_tokens = _take_within_budget(core_memories, max(0, max_tokens - used))
+    used += core_tokens
+
+    logger.debug(
+        "Контекст: %s/%s сообщений, %s/%s recall, %s/%s core, %s из %s токенов.",
+        len(kept_messages), len(history), len(kept_recall), len(recall_memories),
+        len(kept_core), len(core_memories), used, max_tokens
+    )
+    return kept_messages, kept_recall, kept_core
@@ -1,15 +1,93 @@
 # app/custom_nodes.py
 
-from typing import Sequence, Dict, Any
+import asyncio
+import weakref
+from typing import Sequence, Dict, Any, Iterable
 from langchain_core.tools import BaseTool
 from langchain_core.messages import AIMessage, ToolMessage
 from langgraph.prebuilt.tool_executor import ToolExecutor
 from langchain_core.runnables import RunnableConfig
+from .config import Config
+from .metrics import registry, span
+
+tool_latency = registry.histogram("tool_call_seconds", "Время вызова инструмента агента.")
+tool_errors = registry.counter("tool_call_errors_total", "Ошибки и таймауты вызовов инструментов.")
 
 class CustomToolNode:
-    def __init__(self, tools: Sequence[BaseTool]):
+    """Узел графа, выполняющий вызовы инструментов из последнего AIMessage.
+
+    Вызовы выполняются одновременно (не более max_concurrency сразу, каждый с таймаутом),
+    результаты возвращаются в исходном порядке tool_call_id. Инструменты из serialized_tools
+    изменяют общую строку пользователя и для одного пользователя выполняются по очереди.
+    """
+
+    # Блокировки по user_id общие для всех узлов, чтобы сериализовать запись и между ходами
+    _user_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        max_concurrency: int = Config.TOOL_CONCURRENCY,
+        timeout: float = Config.TOOL_TIMEOUT,
+        serialized_tools: Iterable[str] = (),
+    ):
         self.tool_executor = ToolExecutor(tools)
         self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.serialized_tools = set(serialized_tools)
+
+    def _get_user_lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_id] = lock
+        return lock
+
+    async def _run_tool(self, tool_call: Dict[str, Any], state: Dict[str, Any], semaphore: asyncio.Semaphore) -> ToolMessage:
+        if tool_call["name"] not in self.tools_by_name:
+            return ToolMessage(
+                content=f"{tool_call['name']} is not a valid tool, try one of {list(self.tools_by_name.keys())}.",
+                tool_call_id=tool_call["id"]
+            )
+
+        # Создаем config для каждого вызова инструмента
+        tool_config: RunnableConfig = {
+            "configurable": {
+                "user_id": state["user_id"],
+                "query": state.get("query"),
+                "query_embedding": state.get("query_embedding")
+            }
+        }
+
+        # Добавляем config к аргументам инструмента
+        tool_args = tool_call["args"]
+        tool = self.tools_by_name[tool_call["name"]]
+
+        try:
+            async with semaphore:
+                # Вызываем инструмент с обновленными аргументами
+                with span(tool_latency, tool_errors, tool=tool_call["name"]):
+                    if tool_call["name"] in self.serialized_tools:
+                        async with self._get_user_lock(state["user_id"]):
+                            observation = await asyncio.wait_for(tool.ainvoke(tool_args, config=tool_config), self.timeout)
+                    else:
+                        observation = await asyncio.wait_for(tool.ainvoke(tool_args, config=tool_config), self.timeout)
+
+            return ToolMessage(content=str(observation), tool_call_id=tool_call["id"])
+        except asyncio.TimeoutError:
+            return ToolMessage(
+                content=f"Error in tool {tool_call['name']}: timed out after {self.timeout} seconds",
+                tool_call_id=tool_call["id"],
+                status="error"
+            )
+        except Exception as e:
+            # Обработка ошибок инструмента
+            return ToolMessage(
+                content=f"Error in tool {tool_call['name']}: {str(e)}",
+                tool_call_id=tool_call["id"],
+                status="error"
+            )
 
     async def __call__(self, state: Dict[str, Any]) -> Dict[str, Any]:
         messages = state.get("messages", [])
@@ -20,36 +98,11 @@ class CustomToolNode:
         if not hasattr(last_message, 'tool_calls') or not last_message.tool_calls:
             return state
 
-        result = []
-        for tool_call in last_message.tool_calls:
-            if tool_call["name"] not in self.tools_by_name:
-                result.append(ToolMessage(
-                    content=f"{tool_call['name']} is not a valid tool, try one of {list(self.tools_by_name.keys())}.",
-                    tool_call_id=tool_call["id"]
-                ))
-                continue
-
-            # Создаем config для каждого вызова инструмента
-            tool_config: RunnableConfig = {
-                "configurable": {
-                    "user_id": state["user_id"]
-                }
-            }
-            
-            # Добавляем config к аргументам инструмента
-            tool_args = tool_call["args"]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # gather сохраняет порядок результатов в соответствии с порядком tool_calls
+        result = await asyncio.gather(*(
+            self._run_tool(tool_call, state, semaphore)
+            for tool_call in last_message.tool_calls
+        ))
 
-            try:
-                # Вызываем инструмент с обновленными аргументами
-                observation = await self.tools_by_name[tool_call["name"]].ainvoke(tool_args,config=tool_config)
-                
-                result.append(ToolMessage(content=str(observation), tool_call_id=tool_call["id"]))
-            except Exception as e:
-                # Обработка ошибок инструмента
-                result.append(ToolMessage(
-                    content=f"Error in tool {tool_call['name']}: {str(e)}",
-                    tool_call_id=tool_call["id"],
-                    status="error"
-                ))
-
-        return {"messages": result}
+        return {"messages": list(result)}
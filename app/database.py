@@ -4,16 +4,58 @@ import logging
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from .config import Config
+from .metrics import registry
 
 logger = logging.getLogger(__name__)
 
+pool_size = registry.gauge("db_pool_size", "Настроенный размер пула (pool_size).")
+pool_checked_out = registry.gauge("db_pool_checked_out", "Соединения, выданные из пула.")
+pool_checked_in = registry.gauge("db_pool_checked_in", "Свободные соединения в пуле.")
+pool_overflow = registry.gauge("db_pool_overflow", "Открытые соединения минус pool_size (положительно - используется max_overflow).")
+
+def create_engine(url: str, name: str, statement_timeout_ms: int = None) -> AsyncEngine:
+    """Создаёт движок с пулом из конфигурации; statement_timeout_ms переопределяет DB_STATEMENT_TIMEOUT_MS."""
+    if statement_timeout_ms is None:
+        statement_timeout_ms = Config.DB_STATEMENT_TIMEOUT_MS
+    connect_args = {}
+    if statement_timeout_ms:
+        connect_args["server_settings"] = {"statement_timeout": str(statement_timeout_ms)}
+    new_engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        pool_pre_ping=Config.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    pool = new_engine.sync_engine.pool
+    pool_size.set_function(pool.size, engine=name)
+    pool_checked_out.set_function(pool.checkedout, engine=name)
+    pool_checked_in.set_function(pool.checkedin, engine=name)
+    pool_overflow.set_function(pool.overflow, engine=name)
+    return new_engine
+
 try:
-    engine: AsyncEngine = create_async_engine(Config.DATABASE_URL, echo=False)
+    engine: AsyncEngine = create_engine(Config.DATABASE_URL, "main")
     logger.info("Асинхронный движок SQLAlchemy создан успешно.")
 except Exception as e:
-    logger.exception(f"Ошибка при создании движка SQLAlchemy: {e}")
+    logger.exception("Ошибка при создании движка SQLAlchemy: %s", e)
     raise
 
+_vector_engine: AsyncEngine = None
+
+def get_vector_engine() -> AsyncEngine:
+    """Движок для векторного хранилища: тот же пул, если PGVECTOR_URL совпадает с DATABASE_URL."""
+    global _vector_engine
+    if not Config.PGVECTOR_URL or Config.PGVECTOR_URL == Config.DATABASE_URL:
+        return engine
+    if _vector_engine is None:
+        _vector_engine = create_engine(Config.PGVECTOR_URL, "vector")
+        logger.info("Создан отдельный движок для векторного хранилища.")
+    return _vector_engine
+
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
@@ -0,0 +1,139 @@
+# app/embeddings.py
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import LRUCache
+from .config import Config
+from .database import async_session
+from .metrics import registry
+from .models import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в записях) проверять размер постоянного кэша
+PRUNE_EVERY = 500
+
+cache_hits = registry.gauge("embedding_cache_hits", "Попадания в кэш эмбеддингов по уровням.")
+cache_misses = registry.gauge("embedding_cache_misses", "Промахи кэша эмбеддингов по уровням.")
+cache_size = registry.gauge("embedding_cache_memory_size", "Эмбеддинги в кэше в памяти процесса.")
+
+class CachedEmbeddings(Embeddings):
+    """Кэш эмбеддингов по хэшу содержимого поверх другого Embeddings.
+
+    Первый уровень - LRU в памяти процесса, второй (опционально) - таблица embedding_cache.
+    Постоянный уровень вытесняет самые старые записи при превышении max_rows.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        namespace: str,
+        maxsize: int = Config.EMBEDDING_CACHE_SIZE,
+        persistent: bool = Config.EMBEDDING_CACHE_PERSISTENT,
+        max_rows: int = Config.EMBEDDING_CACHE_MAX_ROWS,
+    ):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.memory = LRUCache(maxsize)
+        self.persistent = persistent
+        self.max_rows = max_rows
+        self.persistent_hits = 0
+        self.persistent_misses = 0
+        self._writes_since_prune = 0
+        cache_hits.set_function(lambda: self.memory.hits, level="memory")
+        cache_misses.set_function(lambda: self.memory.misses, level="memory")
+        cache_hits.set_function(lambda: self.persistent_hits, level="persistent")
+        cache_misses.set_function(lambda: self.persistent_misses, level="persistent")
+        cache_size.set_function(lambda: len(self.memory))
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    async def _load_persistent(self, keys: List[str]) -> dict:
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(EmbeddingCache.content_hash, EmbeddingCache.embedding)
+                    .where(EmbeddingCache.content_hash.in_(keys))
+                )
+                return {row.content_hash: [float(x) for x in row.embedding] for row in result}
+        except Exception as e:
+            logger.exception("Ошибка при чтении кэша эмбеддингов: %s", e)
+            return {}
+
+    async def _store_persistent(self, items: dict) -> None:
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    insert(EmbeddingCache)
+                    .values([
+                        {"content_hash": key, "embedding": vector, "created_at": datetime.utcnow()}
+                        for key, vector in items.items()
+                    ])
+                    .on_conflict_do_nothing(index_elements=["content_hash"])
+                )
+                self._writes_since_prune += len(items)
+                if self._writes_since_prune >= PRUNE_EVERY:
+                    self._writes_since_prune = 0
+                    oldest = (
+                        select(EmbeddingCache.content_hash)
+                        .order_by(EmbeddingCache.created_at.desc())
+                        .offset(self.max_rows)
+                    )
+                    await session.execute(delete(EmbeddingCache).where(EmbeddingCache.content_hash.in_(oldest)))
+                await session.commit()
+        except Exception as e:
+            logger.exception("Ошибка при записи в кэш эмбеддингов: %s", e)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors: List[Optional[List[float]]] = [self.memory.get(key) for key in keys]
+
+        missing = {key: text for key, text, vector in zip(keys, texts, vectors) if vector is None}
+        found = {}
+        if missing and self.persistent:
+            found = await self._load_persistent(list(missing))
+            self.persistent_hits += len(found)
+            self.persistent_misses += len(missing) - len(found)
+            for key, vector in found.items():
+                self.memory.set(key, vector)
+                del missing[key]
+
+        computed = {}
+        if missing:
+            embedded = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), embedded))
+            for key, vector in computed.items():
+                self.memory.set(key, vector)
+            if self.persistent:
+                await self._store_persistent(computed)
+
+        return [
+            vector if vector is not None else found.get(key) or computed[key]
+            for key, vector in zip(keys, vectors)
+        ]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Синхронный путь использует только кэш в памяти
+        keys = [self._key(text) for text in texts]
+        vectors = [self.memory.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                self.memory.set(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
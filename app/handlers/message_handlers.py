@@ -1,56 +1,98 @@
 # app/handlers/message_handlers.py
 
 import logging
+import time
 from aiogram import types, Dispatcher
 from ..utils import (
     get_or_create_user,
-    add_message_to_history,
-    get_message_history
+    add_message_to_history
 )
-from ..llm_graph import main_graph
+from ..config import Config
+from ..metrics import registry, span, trace, format_trace
+from ..logging_config import redact
+from .streaming import stream_graph
+from .user_dispatcher import UserTurnDispatcher
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-from ..utils import map_role_to_message
-async def handle_text(message: types.Message):
-    logger.debug(f"Получено текстовое сообщение от пользователя {message.from_user.id}: {message.text}")
-    user = await get_or_create_user(message.from_user.id, message.from_user.username)
-    # 1. Сохранение сообщения в историю
-    await add_message_to_history(
-        user_id=user.id,
-        role="human",  # Роль "user" для сообщений пользователя
-        content=message.text,
-    )
-    logger.debug(f"Сообщение пользователя {user.id} сохранено в историю.")
-
-    # 2. Получение обновлённой истории сообщений
-    message_history = await get_message_history(user.id)
-    # 3. Преобразование сообщений с учётом ролей
-    updated_messages = [map_role_to_message(msg) for msg in message_history[-6:]]  # последние 6 сообщений
-    # 4. Добавление объектов в состояние
-    state = {
-        "user_id": user.id,
-        "query": message.text,
-        "messages": updated_messages,
-        "core_memories": [],
-        "recall_memories": [],
-        "answer": "",
-    }
-
-    # 5. Обработка сообщения через граф
+def get_main_graph():
+    # LangChain, LangGraph и векторное хранилище импортируются при прогреве на старте
+    # или при первом ходе, а не при регистрации обработчиков
+    from ..llm_graph import get_main_graph as build_main_graph
+    return build_main_graph()
+
+turn_latency = registry.histogram("turn_seconds", "Полное время хода: от склеенных сообщений до отправки ответа.")
+turn_errors = registry.counter("turn_errors_total", "Ходы, завершившиеся ошибкой.")
+telegram_send_latency = registry.histogram("telegram_send_seconds", "Время отправки ответа в Telegram.")
+
+async def process_turn(messages: list[types.Message]):
+    """Один ход диалога по одному или нескольким подряд пришедшим сообщениям пользователя."""
+    with trace() as spans:
+        # Ошибки хода считаются один раз - в run_turn, где они и обрабатываются
+        with span(turn_latency):
+            await run_turn(messages)
+    logger.info("Ход пользователя %s: %s.", messages[-1].from_user.id, format_trace(spans))
+
+async def run_turn(messages: list[types.Message]):
+    message = messages[-1]
+    text = "\n".join(msg.text for msg in messages)
     try:
-        logger.info(f"Обработка сообщения от пользователя {user.id} через основной граф.")
-        result_state = await main_graph.ainvoke(state)
+        user = await get_or_create_user(message.from_user.id, message.from_user.username)
+        # 1. Сохранение сообщений в историю
+        for msg in messages:
+            await add_message_to_history(
+                user_id=user.id,
+                role="human",  # Роль "user" для сообщений пользователя
+                content=msg.text,
+            )
+        logger.debug("Сообщения пользователя %s сохранены в историю (%s шт.).", user.id, len(messages))
+
+        # 2. Начальное состояние: история и память загружаются графом одновременно
+        state = {
+            "user_id": user.id,
+            "query": text,
+            "query_embedding": None,
+            "messages": [],
+            "core_memories": [],
+            "recall_memories": [],
+            "answer": "",
+            "llm_calls": 0,
+            "tool_iterations": 0,
+            "deadline": time.monotonic() + Config.TURN_DEADLINE,
+        }
+
+        # 3. Обработка сообщения через граф
+        logger.info("Обработка сообщения от пользователя %s через основной граф.", user.id)
+        main_graph = get_main_graph()
+        if Config.STREAM_RESPONSES:
+            result_state, reply = await stream_graph(main_graph, state, message)
+        else:
+            result_state, reply = await main_graph.ainvoke(state), None
         response = result_state.get("answer", "Извините, произошла ошибка.")
-        # 6. Отправка ответа пользователю
-        await message.reply(response)
-        logger.info(f"Ответ пользователю {user.id} отправлен успешно.")
+        # 4. Отправка ответа пользователю
+        with span(telegram_send_latency):
+            if reply is not None:
+                await reply.finish(response)
+            else:
+                await message.reply(response)
+        logger.info("Ответ пользователю %s отправлен успешно.", user.id)
     except Exception as e:
-        logger.exception(f"Ошибка при обработке LLM графа для пользователя {user.id}: {e}")
+        logger.exception("Ошибка при обработке хода пользователя %s: %s", message.from_user.id, e)
+        turn_errors.inc()
         await message.reply("Произошла ошибка при обработке вашего сообщения. Попробуйте позже.")
 
 
+user_dispatcher = UserTurnDispatcher(process_turn)
+
+async def handle_text(message: types.Message):
+    logger.debug("Получено текстовое сообщение от пользователя %s: %s", message.from_user.id, redact(message.text))
+    # Ходы одного пользователя выполняются по очереди, серии сообщений склеиваются.
+    # Обработчик не ждёт хода, чтобы сообщения, ожидающие паузы или предыдущего хода,
+    # не занимали обработчики обновлений
+    user_dispatcher.enqueue(message)
+
+
 def register_handlers(dp: Dispatcher):
     # Обработчик для текстовых сообщений
     dp.register_message_handler(handle_text, content_types=types.ContentTypes.TEXT, state="*")
@@ -0,0 +1,100 @@
+# app/handlers/streaming.py
+
+import asyncio
+import logging
+import time
+from aiogram import types
+from aiogram.utils.exceptions import TelegramAPIError, MessageNotModified
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+# Узлы графа, чей вывод LLM показывается пользователю
+ANSWER_NODES = ("memory_agent", "final_answer")
+# Индикатор набора в Telegram гаснет примерно через 5 секунд
+TYPING_INTERVAL = 4.5
+
+async def keep_typing(message: types.Message):
+    """Показывает индикатор набора, пока задача не будет отменена."""
+    while True:
+        try:
+            await message.bot.send_chat_action(message.chat.id, types.ChatActions.TYPING)
+        except TelegramAPIError as e:
+            logger.debug("Не удалось отправить индикатор набора: %s", e)
+        await asyncio.sleep(TYPING_INTERVAL)
+
+class StreamingReply:
+    """Ответ пользователю, который редактируется по мере генерации текста.
+
+    Первое обновление отправляет сообщение, следующие редактируют его не чаще,
+    чем раз в interval секунд, чтобы не упираться в лимиты Telegram на редактирование.
+    """
+
+    def __init__(self, message: types.Message, interval: float = Config.STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.sent = None
+        self.shown_text = ""
+        self.last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False):
+        text = text[:MAX_MESSAGE_LENGTH]
+        if not text.strip() or text == self.shown_text:
+            return
+        if not force and time.monotonic() - self.last_edit < self.interval:
+            return
+        try:
+            if self.sent is None:
+                self.sent = await self.message.reply(text)
+            else:
+                await self.sent.edit_text(text)
+            self.shown_text = text
+        except MessageNotModified:
+            pass
+        except TelegramAPIError as e:
+            # Промежуточный текст может быть невалидным HTML - дождёмся следующего обновления
+            if force:
+                raise
+            logger.debug("Не удалось обновить потоковый ответ: %s", e)
+        self.last_edit = time.monotonic()
+
+    async def finish(self, text: str):
+        if self.sent is None:
+            await self.message.reply(text)
+        else:
+            await self.update(text, force=True)
+
+async def stream_graph(graph, state: dict, message: types.Message) -> tuple[dict, StreamingReply]:
+    """Запускает граф в потоковом режиме и показывает ответ агента по мере генерации.
+
+    Возвращает итоговое состояние графа и StreamingReply, через который
+    вызывающий код отправляет финальный текст.
+    """
+    reply = StreamingReply(message)
+    typing = asyncio.create_task(keep_typing(message))
+    result_state = None
+    text = ""
+    try:
+        # Агент работает в подграфе памяти: без subgraphs=True его токены не попадают в поток
+        async for namespace, mode, payload in graph.astream(
+            state, stream_mode=["messages", "values"], subgraphs=True
+        ):
+            if mode == "values":
+                # Итоговое состояние берётся только из корневого графа
+                if namespace == ():
+                    result_state = payload
+                continue
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") not in ANSWER_NODES:
+                continue
+            if isinstance(chunk.content, str) and chunk.content:
+                text += chunk.content
+                await reply.update(text)
+            elif getattr(chunk, "tool_call_chunks", None) and text:
+                # Шаг агента закончился вызовом инструментов - следующий шаг начнёт ответ заново
+                text = ""
+    finally:
+        typing.cancel()
+    return result_state, reply
@@ -0,0 +1,97 @@
+# app/handlers/user_dispatcher.py
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram import types
+from ..config import Config
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+turns_running = registry.gauge("turns_running", "Ходы, выполняющиеся в данный момент.")
+turn_messages_pending = registry.gauge("turn_messages_pending", "Сообщения, ожидающие своего хода.")
+
+class UserTurnDispatcher:
+    """Последовательная обработка ходов каждого пользователя со склейкой серий сообщений.
+
+    На пользователя работает не больше одного обработчика, одновременно выполняется не больше
+    concurrency ходов всех пользователей. Сообщения, пришедшие за время ожидания паузы или пока
+    обрабатывается предыдущий ход, передаются в process_turn одной пачкой. enqueue возвращает
+    управление сразу после постановки сообщения в очередь, submit - когда ход с ним обработан.
+    """
+
+    def __init__(
+        self,
+        process_turn: Callable[[List[types.Message]], Awaitable[None]],
+        debounce: float = Config.BURST_DEBOUNCE,
+        max_wait: float = Config.BURST_MAX_WAIT,
+        concurrency: int = Config.TURN_CONCURRENCY,
+    ):
+        self.process_turn = process_turn
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._running = asyncio.Semaphore(max(1, concurrency))
+        self._running_count = 0
+        self._pending: Dict[int, List[Tuple[types.Message, Optional[asyncio.Future]]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        turns_running.set_function(lambda: self._running_count)
+        turn_messages_pending.set_function(lambda: sum(len(batch) for batch in self._pending.values()))
+
+    def enqueue(self, message: types.Message) -> None:
+        """Ставит сообщение в очередь хода пользователя, не дожидаясь самого хода."""
+        self._put(message, None)
+
+    async def submit(self, message: types.Message) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._put(message, future)
+        await future
+
+    async def join(self) -> None:
+        """Дожидается завершения всех начатых и ожидающих ходов."""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def _put(self, message: types.Message, future: Optional[asyncio.Future]) -> None:
+        key = message.from_user.id
+        self._pending.setdefault(key, []).append((message, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._worker(key))
+
+    async def _wait_for_pause(self, key: int) -> None:
+        started = time.monotonic()
+        while True:
+            count = len(self._pending[key])
+            remaining = self.max_wait - (time.monotonic() - started)
+            await asyncio.sleep(max(0.0, min(self.debounce, remaining)))
+            if len(self._pending[key]) == count or time.monotonic() - started >= self.max_wait:
+                return
+
+    async def _worker(self, key: int) -> None:
+        try:
+            while self._pending.get(key):
+                if self.debounce > 0:
+                    await self._wait_for_pause(key)
+                batch = self._pending.pop(key)
+                if len(batch) > 1:
+                    logger.debug("Склеено %s сообщений пользователя %s в один ход.", len(batch), key)
+                try:
+                    # Ограничиваются выполняющиеся ходы, а не ожидающие своей очереди сообщения
+                    async with self._running:
+                        self._running_count += 1
+                        try:
+                            await self.process_turn([message for message, _ in batch])
+                        finally:
+                            self._running_count -= 1
+                    for _, future in batch:
+                        if future is not None and not future.done():
+                            future.set_result(None)
+                except Exception as e:
+                    waiters = [future for _, future in batch if future is not None and not future.done()]
+                    if len(waiters) < len(batch):
+                        logger.exception("Ошибка хода пользователя %s: %s", key, e)
+                    for future in waiters:
+                        future.set_exception(e)
+        finally:
+            del self._workers[key]
@@ -0,0 +1,48 @@
+# app/llm.py
+
+import logging
+from functools import lru_cache
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def get_http_async_client() -> httpx.AsyncClient:
+    """Общий HTTP-клиент к провайдеру, чтобы соединения и TLS-сессии переиспользовались между вызовами."""
+    logger.debug("Создание HTTP-клиента к провайдеру LLM.")
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=Config.LLM_TIMEOUT,
+    )
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOpenAI:
+    logger.debug("Создание клиента ChatOpenAI.")
+    return ChatOpenAI(
+        api_key=Config.OPENAI_API_KEY,
+        base_url=Config.OPENAI_BASE_PROVIDER,
+        model=Config.LLM_MODEL,
+        timeout=Config.LLM_TIMEOUT,
+        max_retries=Config.LLM_MAX_RETRIES,
+        http_async_client=get_http_async_client(),
+        # Учёт токенов (в том числе закэшированных) и при потоковой выдаче
+        stream_usage=True,
+    )
+
+def create_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(
+        api_key=Config.OPENAI_API_KEY,
+        base_url=Config.OPENAI_BASE_PROVIDER,
+        model=Config.EMBEDDING_MODEL,
+        dimensions=Config.EMBEDDING_DIMENSIONS,
+        max_retries=Config.LLM_MAX_RETRIES,
+        http_async_client=get_http_async_client(),
+    )
@@ -1,35 +1,32 @@
 # app/llm_graph.py
 
+import asyncio
 import logging
+import time
+from functools import lru_cache
 from langgraph.graph import StateGraph, END
 from .schemas.state import State
-from .utils import get_memories
+from .utils import get_memories, get_message_history, add_message_to_history, map_role_to_message
+from .metrics import registry, span, timed
+from .context import build_context
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage, ToolMessage
+from .llm import get_llm
 from .tools.memory_tools import save_recall_memory, search_memory, store_core_memory
-from sqlalchemy import update, select
 from .config import Config
-from .database import async_session
-from .models import MessageHistory
 from datetime import datetime
-from .vectorstore import get_vectorstores
+from .vectorstore import search_user_facts, embed_query
 from .custom_nodes import CustomToolNode
-import json
 
 logger = logging.getLogger(__name__)
 
-def create_memory_subgraph():
-    memory_graph = StateGraph(State)
-
-    prompt = ChatPromptTemplate.from_messages([
-    (
-        "system",
-        """Вы - личный ассистент в Telegram. Ваша главная задача - эффективно управлять информацией пользователя, сохранять важные воспоминания, факты, проводить поиск и общение с пользователем.
+SYSTEM_INSTRUCTIONS = """Вы - личный ассистент в Telegram. Ваша главная задача - эффективно управлять информацией пользователя, сохранять важные воспоминания, факты, проводить поиск и общение с пользователем.
 
 Инструкции:
 1. Анализ и сохранение личной информации:
    - Автоматически выявляйте и сохраняйте личную информацию о пользователе (имя, работа, распорядок дня и т.д.) без запроса подтверждения.
    - Используйте store_core_memory для ключевой информации и save_recall_memory для деталей.
+   - Core воспоминания показаны в виде "[id] текст"; чтобы исправить или дополнить факт, передайте его id в store_core_memory как memory_id.
 
 2. Поиск и извлечение информации:
    - Используйте search_memory для поиска в сохраненных воспоминаниях.
@@ -44,164 +41,286 @@ def create_memory_subgraph():
    - Будьте проактивны в напоминании о важных сохраненных данных, когда это уместно.
 
 Помните: ваша цель - быть максимально полезным, эффективно управляя информацией пользователя и минимизируя необходимость в дополнительных вопросах.
-Набор базовых воспоминаний:
+Набор базовых воспоминаний и текущее время передаются следующим системным сообщением."""
+
+# Изменяемая часть промпта: память пользователя и время, зафиксированное один раз на ход
+CONTEXT_TEMPLATE = """Набор базовых воспоминаний:
 Core - {core_memories}
 Recall - {recall_memories}
-Для большего понимания обстановки, дано текущее время и дата, можно использовать его для ответа или записи: {timestamp}"""),
-    ("placeholder", "{messages}"),
-])
+Для большего понимания обстановки, дано текущее время и дата, можно использовать его для ответа или записи: {timestamp}"""
+
+llm_input_tokens = registry.counter("llm_input_tokens_total", "Входные токены вызовов LLM.")
+llm_cached_input_tokens = registry.counter(
+    "llm_cached_input_tokens_total", "Входные токены, прочитанные из кэша префикса промпта провайдера."
+)
+llm_output_tokens = registry.counter("llm_output_tokens_total", "Выходные токены вызовов LLM.")
 
+def record_usage(response: AIMessage, user_id: int) -> None:
+    """Учитывает токены ответа LLM, в том числе прочитанные из кэша префикса."""
+    usage = response.usage_metadata
+    if not usage:
+        return
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    llm_input_tokens.inc(usage["input_tokens"])
+    llm_cached_input_tokens.inc(cached)
+    llm_output_tokens.inc(usage["output_tokens"])
+    logger.info(
+        "Токены LLM для пользователя %s: вход %s (из кэша %s), выход %s.",
+        user_id, usage['input_tokens'], cached, usage['output_tokens']
+    )
+
+node_latency = registry.histogram("graph_node_seconds", "Время выполнения узлов графов.")
+node_errors = registry.counter("graph_node_errors_total", "Ошибки в узлах графов.")
+llm_call_latency = registry.histogram("llm_call_seconds", "Время одного вызова LLM.")
+llm_call_errors = registry.counter("llm_call_errors_total", "Ошибки вызовов LLM.")
+
+def add_timed_node(graph: StateGraph, graph_name: str, name: str, node) -> None:
+    graph.add_node(name, timed(node_latency, node_errors, graph=graph_name, node=name)(node))
+
+agent_llm_calls = registry.histogram(
+    "agent_llm_calls_per_turn", "Число вызовов LLM за один ход агента.", buckets=(1, 2, 3, 4, 5, 6, 8, 10)
+)
+agent_limit_hits = registry.counter("agent_limit_hits_total", "Ходы, завершённые принудительным ответом по лимиту.")
+
+# Шагов графа на один вызов LLM: memory_agent и tools, плюс финальный ответ и запас
+GRAPH_RECURSION_LIMIT = 2 * Config.AGENT_MAX_LLM_CALLS + 4
+
+def turn_limit_reached(state: State) -> str:
+    """Причина, по которой агенту пора отвечать без инструментов, или пустая строка."""
+    if time.monotonic() >= state.get("deadline", float("inf")):
+        return "deadline"
+    if state.get("llm_calls", 0) >= Config.AGENT_MAX_LLM_CALLS - 1:
+        return "llm_calls"
+    if state.get("tool_iterations", 0) >= Config.AGENT_MAX_TOOL_ITERATIONS:
+        return "tool_iterations"
+    return ""
+
+def create_memory_subgraph():
+    memory_graph = StateGraph(State)
+
+    # Статические инструкции идут первым сообщением и не меняются между вызовами,
+    # чтобы провайдер мог переиспользовать закэшированный префикс промпта
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_INSTRUCTIONS),
+        ("system", CONTEXT_TEMPLATE),
+        ("placeholder", "{messages}"),
+    ])
+
+    tools = [save_recall_memory, search_memory, store_core_memory]
+    # Клиент и цепочки создаются один раз и переиспользуются всеми вызовами агента.
+    # Финальный ответ передаёт те же инструменты с tool_choice="none", чтобы префикс промпта совпадал
+    chain = prompt | get_llm().bind_tools(tools)
+    final_chain = prompt | get_llm().bind_tools(tools, tool_choice="none")
+
+    def prompt_input(state: State) -> dict:
+        return {
+            "messages": state["messages"],
+            "core_memories": "\n".join(state["core_memories"]),
+            "recall_memories": "\n".join(state["recall_memories"]),
+            "timestamp": state["timestamp"]
+        }
 
     async def memory_agent(state: State):
         logger.debug("Вход в memory_agent")
-        llm = ChatOpenAI(
-            api_key=Config.OPENAI_API_KEY,
-            base_url=Config.OPENAI_BASE_PROVIDER,
-            model="gpt-4o-2024-11-20"
-        )
-        chain = prompt | llm.bind_tools([
-            save_recall_memory,
-            search_memory,
-            store_core_memory
-        ])
-
         try:
             logger.info("Вызов LLM для обработки памяти и управления объектами.")
-            response = await chain.ainvoke({
-                "messages": state["messages"],
-                "core_memories": "\n".join(state["core_memories"]),
-                "recall_memories": "\n".join(state["recall_memories"]),
-                "timestamp":str(datetime.utcnow().isoformat())
-            })
+            # Вызов не должен выходить за дедлайн хода; после таймаута ответ даёт final_answer
+            remaining = max(0.0, state.get("deadline", float("inf")) - time.monotonic())
+            try:
+                with span(llm_call_latency, llm_call_errors, node="memory_agent"):
+                    response = await asyncio.wait_for(
+                        chain.ainvoke(prompt_input(state)),
+                        None if remaining == float("inf") else remaining
+                    )
+            except asyncio.TimeoutError:
+                logger.warning("Вызов LLM в memory_agent прерван по дедлайну хода для пользователя %s.", state['user_id'])
+                return {"llm_calls": state.get("llm_calls", 0) + 1}
             logger.debug("Получен ответ от LLM в memory_agent.")
-            return {"messages": response, "answer": response.content}
+            record_usage(response, state["user_id"])
+            return {
+                "messages": response,
+                "answer": response.content,
+                "llm_calls": state.get("llm_calls", 0) + 1,
+                "tool_iterations": state.get("tool_iterations", 0) + bool(response.tool_calls),
+            }
         except Exception as e:
-            logger.exception(f"Ошибка в memory_agent: {e}")
+            logger.exception("Ошибка в memory_agent: %s", e)
             raise
 
-    memory_graph.add_node("memory_agent", memory_agent)
+    async def final_answer(state: State):
+        reason = turn_limit_reached(state)
+        logger.info("Принудительный финальный ответ для пользователя %s: лимит %s.", state['user_id'], reason)
+        agent_limit_hits.inc(reason=reason)
+        messages = []
+        last_message = state["messages"][-1]
+        if isinstance(last_message, AIMessage) and last_message.tool_calls:
+            # Вызовы, на которые не хватило времени, закрываются ответом об ошибке
+            messages = [
+                ToolMessage(
+                    content=f"Error in tool {call['name']}: turn time limit reached, tool was not called",
+                    tool_call_id=call["id"],
+                    status="error"
+                )
+                for call in last_message.tool_calls
+            ]
+        with span(llm_call_latency, llm_call_errors, node="final_answer"):
+            response = await asyncio.wait_for(
+                final_chain.ainvoke(prompt_input({**state, "messages": state["messages"] + messages})),
+                Config.FINAL_ANSWER_TIMEOUT
+            )
+        record_usage(response, state["user_id"])
+        return {
+            "messages": messages + [response],
+            "answer": response.content,
+            "llm_calls": state.get("llm_calls", 0) + 1,
+        }
+
+    add_timed_node(memory_graph, "memory", "memory_agent", memory_agent)
+    add_timed_node(memory_graph, "memory", "final_answer", final_answer)
 
     def route_tools(state: State) -> str:
         last_message = state["messages"][-1]
-        if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+        if not isinstance(last_message, AIMessage):
+            # memory_agent не успел ответить до дедлайна
+            return "final_answer"
+        if last_message.tool_calls:
+            # После дедлайна инструменты уже не выполняются
+            if turn_limit_reached(state) == "deadline":
+                return "final_answer"
             logger.debug("Перенаправление на узел 'tools'")
             return "tools"
         logger.debug("Завершение обработки в memory_graph.")
         return END
 
     # Создание узлов для инструментов памяти и управления объектами
-    memory_graph.add_node("tools", CustomToolNode([save_recall_memory, search_memory, store_core_memory]))
+    memory_graph.add_node("tools", CustomToolNode(
+        tools,
+        serialized_tools=[store_core_memory.name]
+    ))
+    write_tools = {save_recall_memory.name, store_core_memory.name}
+
+    def route_after_tools(state: State) -> str:
+        # Если модель уже ответила пользователю и вызывала только запись памяти,
+        # результат инструментов ответ не изменит - лишний вызов LLM не нужен
+        ai_message = next(msg for msg in reversed(state["messages"]) if isinstance(msg, AIMessage))
+        if ai_message.content and all(call["name"] in write_tools for call in ai_message.tool_calls):
+            logger.debug("Ответ уже готов, завершение после записи памяти.")
+            return END
+        if turn_limit_reached(state):
+            return "final_answer"
+        return "memory_agent"
+
     memory_graph.add_conditional_edges("memory_agent", route_tools)
-    memory_graph.add_edge("tools", "memory_agent")
+    memory_graph.add_conditional_edges("tools", route_after_tools)
+    memory_graph.add_edge("final_answer", END)
 
     memory_graph.set_entry_point("memory_agent")
     logger.info("memory_subgraph создан и настроен.")
     return memory_graph.compile()
 
-memory_subgraph = create_memory_subgraph()
+@lru_cache(maxsize=1)
+def get_memory_subgraph():
+    """Граф памяти собирается при первом обращении, а не при импорте модуля."""
+    return create_memory_subgraph()
+
+context_fetch_latency = registry.histogram("context_fetch_seconds", "Время загрузки частей контекста перед вызовом LLM.")
+
+async def timed_fetch(source: str, user_id: int, fetch, default):
+    """Выполняет одну загрузку контекста, замеряя время; при ошибке возвращает default."""
+    started = time.perf_counter()
+    try:
+        return await fetch()
+    except Exception as e:
+        logger.exception("Ошибка при загрузке %s для пользователя %s: %s", source, user_id, e)
+        return default
+    finally:
+        elapsed = time.perf_counter() - started
+        context_fetch_latency.observe(elapsed, source=source)
+        logger.debug("Загрузка %s для пользователя %s заняла %.1f мс.", source, user_id, elapsed * 1000)
+
+def format_core_memory(fact: dict) -> str:
+    return f"[{fact['id']}] {fact['content']}"
 
 async def load_memories(state: State) -> State:
+    """Загружает core память, recall память и хвост истории одновременно.
+
+    Сообщение пользователя векторизуется один раз в ветке recall, вектор
+    сохраняется в состоянии и переиспользуется инструментами.
+    """
     logger.debug("Загрузка памяти и объектов пользователя в граф.")
     user_id = state["user_id"]
-    try:
-        core_memories = await get_memories(user_id)
-        vectorstores = await get_vectorstores()
-        user_facts_vectorstore = vectorstores["user_facts"]
-        
-        recall_docs = await user_facts_vectorstore.asimilarity_search(
-            query=state["query"],
-            k=5,
-            filter=f"(langchain_metadata->>'user_id')::int = {user_id}"
-        )
-        recall_memories = []
-        for doc in recall_docs:
-            if "timestamp" in doc.metadata:
-                recall_memories.append(doc.page_content + f" Timestamp:{doc.metadata['timestamp']}")
-            else:
-                recall_memories.append(doc.page_content)
-        logger.debug("Память пользователя загружена успешно.")
-    except Exception as e:
-        logger.exception(f"Ошибка при загрузке памяти пользователя {user_id}: {e}")
-        core_memories = []
-        recall_memories = []
+    query_embedding = None
+
+    async def fetch_recall():
+        nonlocal query_embedding
+        query_embedding = await embed_query(state["query"])
+        return await search_user_facts(user_id, state["query"], k=5, embedding=query_embedding)
+
+    async def fetch_core():
+        return [format_core_memory(fact) for fact in await get_memories(user_id)]
+
+    async def fetch_history():
+        return await get_message_history(user_id, limit=Config.HISTORY_LIMIT)
+
+    core_memories, recall_memories, history = await asyncio.gather(
+        timed_fetch("core", user_id, fetch_core, []),
+        timed_fetch("recall", user_id, fetch_recall, []),
+        timed_fetch("history", user_id, fetch_history, []),
+    )
+    # История по токенам ограничивается только общим бюджетом контекста
+    history, recall_memories, core_memories = build_context(
+        history, recall_memories, core_memories, Config.CONTEXT_MAX_TOKENS
+    )
+    messages = [map_role_to_message(msg) for msg in history]
+    logger.debug("Память пользователя загружена успешно.")
     return {
         "core_memories": core_memories,
-        "recall_memories": recall_memories
+        "recall_memories": recall_memories,
+        "query_embedding": query_embedding,
+        "messages": messages,
+        # Время фиксируется один раз на ход, чтобы промпт не менялся между шагами агента
+        "timestamp": datetime.utcnow().isoformat()
     }
 
 async def process_message(state: State) -> State:
     logger.debug("Начало обработки сообщения в process_message.")
-    # Получаем последние 6 сообщений для контекста
-    async with async_session() as session:
-        try:
-            result = await session.execute(
-                select(MessageHistory).where(MessageHistory.user_id == state["user_id"]).order_by(MessageHistory.created_at.desc()).limit(6)
-            )
-            message_history = result.scalars().all()
-            
-            if message_history:
-                messages = []
-                for msg_hist in reversed(message_history):
-                    messages.extend(json.loads(msg_hist.messages))
-                logger.debug(f"Загружено {len(messages)} сообщений из истории для пользователя {state['user_id']}.")
-            else:
-                messages = []
-                logger.debug(f"История сообщений пользователя {state['user_id']} пуста.")
-        except Exception as e:
-            logger.exception(f"Ошибка при получении истории сообщений для пользователя {state['user_id']}: {e}")
-            messages = []
+    # История диалога уже загружена в load_memories и передана в state["messages"]
 
     # Обработка сообщения через граф памяти и управления объектами
     try:
-        logger.info(f"Обработка сообщения через memory_subgraph для пользователя {state['user_id']}.")
-        result = await memory_subgraph.ainvoke(state)
+        logger.info("Обработка сообщения через memory_subgraph для пользователя %s.", state['user_id'])
+        result = await get_memory_subgraph().ainvoke(state, config={"recursion_limit": GRAPH_RECURSION_LIMIT})
         logger.debug("Ответ от memory_subgraph получен.")
+        agent_llm_calls.observe(result.get("llm_calls", 0))
     except Exception as e:
-        logger.exception(f"Ошибка при вызове memory_subgraph для пользователя {state['user_id']}: {e}")
+        logger.exception("Ошибка при вызове memory_subgraph для пользователя %s: %s", state['user_id'], e)
         raise
 
-    # Сохранение обновленной истории сообщений
-    async with async_session() as session:
-        try:
-            new_message = {
-                "role": "bot",
-                "content": result["answer"],
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            if message_history:
-                messages_list = []
-                for msg_hist in message_history:
-                    messages = json.loads(msg_hist.messages)
-                    messages_list.extend(messages)
-                messages_list.append(new_message)
-                
-                await session.execute(
-                    update(MessageHistory)
-                    .where(MessageHistory.user_id == state["user_id"])
-                    .values(messages=json.dumps(messages_list), updated_at=datetime.utcnow())
-                )
-                logger.debug(f"Добавлено новое сообщение в существующую историю пользователя {state['user_id']}.")
-            else:
-                history = MessageHistory(user_id=state["user_id"], messages=json.dumps([new_message]))
-                session.add(history)
-                logger.debug(f"Создана новая история сообщений для пользователя {state['user_id']}.")
-            
-            await session.commit()
-            logger.info(f"История сообщений пользователя {state['user_id']} обновлена.")
-        except Exception as e:
-            logger.exception(f"Ошибка при сохранении истории сообщений для пользователя {state['user_id']}: {e}")
+    # Сохранение ответа в историю сообщений
+    await add_message_to_history(
+        user_id=state["user_id"],
+        role="bot",
+        content=result["answer"],
+    )
 
     return result
 
 
 def create_main_graph():
     graph = StateGraph(State)
-    graph.add_node("load_memories", load_memories)
-    graph.add_node("process_message", process_message)
+    add_timed_node(graph, "main", "load_memories", load_memories)
+    add_timed_node(graph, "main", "process_message", process_message)
     graph.set_entry_point("load_memories")
     graph.add_edge("load_memories", "process_message")
     graph.add_edge("process_message", END)
     logger.info("main_graph создан и настроен.")
     return graph.compile()
 
-main_graph = create_main_graph()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_main_graph():
+    return create_main_graph()
+
+def build_graphs() -> None:
+    """Собирает оба графа заранее, чтобы первый ход не тратил на это время."""
+    get_memory_subgraph()
+    get_main_graph()
\ No newline at end of file
@@ -0,0 +1,80 @@
+# app/logging_config.py
+
+import json
+import logging
+import random
+from datetime import datetime, timezone
+
+from .config import Config
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra и попадает в JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с временем, уровнем, логгером, сообщением и полями extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DebugSamplingFilter(logging.Filter):
+    """Пропускает только долю sample_rate DEBUG-записей; записи уровня INFO и выше не трогает."""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.sample_rate
+
+class redact:
+    """Содержимое сообщений и памяти для логов: выводится, только если включён LOG_PAYLOADS.
+
+    Строка формируется лениво, когда запись действительно попадает в лог.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        if Config.LOG_PAYLOADS:
+            return str(self.value)
+        if isinstance(self.value, str):
+            return f"<{len(self.value)} символов>"
+        if isinstance(self.value, (list, tuple, dict)):
+            return f"<{len(self.value)} элементов>"
+        return "<скрыто>"
+
+    __repr__ = __str__
+
+def setup_logging(level: str = Config.LOG_LEVEL, fmt: str = Config.LOG_FORMAT) -> None:
+    """Настраивает корневой логгер: уровень, формат (text или json) и выборку DEBUG-записей."""
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    if Config.LOG_DEBUG_SAMPLE_RATE < 1:
+        handler.addFilter(DebugSamplingFilter(Config.LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    # Библиотеки на DEBUG выводят тела запросов и ответов - их уровень не ниже INFO
+    for name in ("httpx", "httpcore", "openai", "asyncio", "aiohttp.access"):
+        logging.getLogger(name).setLevel(max(root.level, logging.INFO))
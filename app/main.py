@@ -1,48 +1,85 @@
 # app/main.py
 
-import asyncio
+import time
+
+# Отсчёт фаз запуска начинается до импорта зависимостей
+_process_started = time.perf_counter()
+
 import logging
 from aiogram import Bot, Dispatcher, executor
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 
 from .config import Config
+from .logging_config import setup_logging
 from .handlers import register_all_handlers
-from .vectorstore import init_vectorstore
+from .handlers.message_handlers import user_dispatcher
+from .write_queue import memory_write_queue
+from .webhook import run_webhook
+from .metrics_export import metrics_exporter
+from . import sharding
+from .sharding import run_sharded
+from .startup import warm_up
 
-# Настройка логирования
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+_imports_finished = time.perf_counter()
 
-# Глобальное хранилище для векторных сторах
-vectorstores = None
+# Настройка логирования: уровень и формат из конфигурации
+setup_logging()
+logger = logging.getLogger(__name__)
 
 async def on_startup(dp):
-    global vectorstores
+    started = time.perf_counter()
     try:
-        vectorstores = await init_vectorstore()
-        logger.info("Векторное хранилище инициализировано.")
+        phases = await warm_up()
     except Exception as e:
-        logger.exception(f"Ошибка при инициализации векторного хранилища: {e}")
+        logger.exception("Ошибка при подготовке к работе: %s", e)
         raise
+    memory_write_queue.start()
+    # В webhook-режиме /metrics отдаёт сам webhook-сервер
+    await metrics_exporter.start(worker_index=sharding.worker_index, serve_http=Config.BOT_MODE != "webhook")
+    logger.info(
+        "Бот готов к работе за %.2f с: импорт %.2f с, прогрев %.2f с (%s).",
+        time.perf_counter() - _process_started,
+        _imports_finished - _process_started,
+        time.perf_counter() - started,
+        ", ".join(f"{name} {seconds:.2f} с" for name, seconds in phases.items()),
+    )
 
-def main():
-    try:
-        bot = Bot(token=Config.BOT_TOKEN, parse_mode="HTML")
-        storage = MemoryStorage()
-        dp = Dispatcher(bot, storage=storage)
+async def on_shutdown(dp):
+    # Обработчики обновлений не ждут ходов, поэтому начатые ходы дожидаемся здесь
+    await user_dispatcher.join()
+    # Дописываем накопленные записи памяти перед остановкой
+    await memory_write_queue.stop()
+    await metrics_exporter.stop()
+
+def create_dispatcher() -> Dispatcher:
+    bot = Bot(token=Config.BOT_TOKEN, parse_mode="HTML")
+    storage = MemoryStorage()
+    dp = Dispatcher(bot, storage=storage)
+
+    # Добавляем Middleware для логирования
+    dp.middleware.setup(LoggingMiddleware())
 
-        # Добавляем Middleware для логирования
-        dp.middleware.setup(LoggingMiddleware())
+    # Регистрируем все обработчики
+    register_all_handlers(dp)
+    return dp
 
-        # Регистрируем все обработчики
-        register_all_handlers(dp)
+def main():
+    try:
+        logger.info("Запуск бота в режиме %s.", Config.BOT_MODE)
+        if Config.BOT_MODE == "sharded":
+            # Каждый процесс-обработчик создаёт свой диспетчер и выполняет on_startup сам
+            run_sharded(create_dispatcher, on_startup=on_startup, on_shutdown=on_shutdown)
+            return
 
-        # Запускаем поллинг с вызовом on_startup при старте
-        logger.info("Запуск бота.")
-        executor.start_polling(dp, on_startup=on_startup)
+        dp = create_dispatcher()
+        if Config.BOT_MODE == "webhook":
+            run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+        else:
+            # Запускаем поллинг с вызовом on_startup при старте
+            executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
     except Exception as e:
-        logger.exception(f"Критическая ошибка при запуске бота: {e}")
+        logger.exception("Критическая ошибка при запуске бота: %s", e)
 
 if __name__ == '__main__':
     main()
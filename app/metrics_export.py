@@ -0,0 +1,82 @@
+# app/metrics_export.py
+
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiohttp import web
+
+from .config import Config
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+class MetricsExporter:
+    """Выгрузка метрик процесса для режимов без webhook-сервера.
+
+    Поднимает HTTP-эндпоинт /metrics в формате Prometheus и/или периодически
+    перезаписывает файл с тем же содержимым (запись атомарная, через временный файл).
+    """
+
+    def __init__(
+        self,
+        host: str = Config.METRICS_HOST,
+        port: int = Config.METRICS_PORT,
+        path: str = Config.METRICS_FILE,
+        interval: float = Config.METRICS_FILE_INTERVAL,
+    ):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self._runner: Optional[web.AppRunner] = None
+        self._task = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain")
+
+    def _write_file(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(registry.render())
+        os.replace(tmp_path, self.path)
+
+    async def _write_periodically(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self._write_file)
+            except OSError as e:
+                logger.warning("Не удалось записать метрики в %s: %s", self.path, e)
+
+    async def start(self, worker_index: Optional[int] = None, serve_http: bool = True) -> None:
+        """Запускает выгрузку; у процесса-обработчика свой порт и файл, чтобы не было конфликтов."""
+        if worker_index is not None:
+            self.port = self.port + worker_index + 1 if self.port else 0
+            self.path = f"{self.path}.{worker_index}" if self.path else ""
+        if serve_http and self.port:
+            app = web.Application()
+            app.router.add_get("/metrics", self.handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info("Метрики доступны на http://%s:%s/metrics.", self.host, self.port)
+        if self.path:
+            self._task = asyncio.create_task(self._write_periodically())
+            logger.info("Метрики записываются в %s раз в %s с.", self.path, self.interval)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            try:
+                self._write_file()
+            except OSError as e:
+                logger.warning("Не удалось записать метрики в %s: %s", self.path, e)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics_exporter = MetricsExporter()
@@ -1,8 +1,9 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.dialects.postgresql import JSONB
+from pgvector.sqlalchemy import Vector
 from datetime import datetime
 
 Base = declarative_base()
@@ -15,9 +16,13 @@ class User(Base):
     username = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     message_histories = relationship("MessageHistory", back_populates="user")
+    messages = relationship("Message", back_populates="user")
     memories = relationship("Memory", back_populates="user")
+    core_memories = relationship("CoreMemory", back_populates="user")
 
 class MessageHistory(Base):
+    # Устаревшее хранилище истории одним JSON-массивом, заменено таблицей messages.
+    # Оставлено для отката миграции, приложение в него больше не пишет.
     __tablename__ = 'message_histories'
 
     id = Column(Integer, primary_key=True, index=True)
@@ -28,7 +33,23 @@ class MessageHistory(Base):
 
     user = relationship("User", back_populates="message_histories")
 
+class Message(Base):
+    __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    role = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    user = relationship("User", back_populates="messages")
+
 class Memory(Base):
+    # Устаревшее хранилище core памяти одним JSON-списком, заменено таблицей core_memories.
+    # Оставлено для отката миграции, приложение в него больше не пишет.
     __tablename__ = 'memories'
 
     id = Column(Integer, primary_key=True, index=True)
@@ -38,3 +59,45 @@ class Memory(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = relationship("User", back_populates="memories")
+
+class CoreMemory(Base):
+    # Один core факт пользователя; id показывается агенту и используется для точечного обновления
+    __tablename__ = 'core_memories'
+    __table_args__ = (
+        Index('ix_core_memories_user_id_priority_updated_at', 'user_id', 'priority', 'updated_at'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    content = Column(Text, nullable=False)
+    priority = Column(Integer, default=0, nullable=False)
+    token_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    user = relationship("User", back_populates="core_memories")
+
+class EmbeddingCache(Base):
+    # Постоянный уровень кэша эмбеддингов, ключ - хэш модели, размерности и текста
+    __tablename__ = 'embedding_cache'
+
+    content_hash = Column(String, primary_key=True)
+    embedding = Column(Vector(), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class PendingMemoryWrite(Base):
+    # Очередь отложенной записи памяти: строка удаляется после успешного применения,
+    # а после MEMORY_WRITE_MAX_ATTEMPTS неудачных попыток остаётся со status = 'dead' для разбора
+    __tablename__ = 'pending_memory_writes'
+    __table_args__ = (
+        Index('ix_pending_memory_writes_user_id_id', 'user_id', 'id'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    kind = Column(String, nullable=False)  # recall или core
+    payload = Column(JSONB, nullable=False)
+    status = Column(String, default='pending', server_default='pending', nullable=False)  # pending или dead
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -1,29 +1,25 @@
 # app/schemas/state.py
 
-import logging
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 from typing_extensions import TypedDict
 from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 
-logger = logging.getLogger(__name__)
-
 class GraphConfig(TypedDict):
     user_id: int
+    query: Optional[str]
+    query_embedding: Optional[List[float]]
 
 class State(TypedDict):
     user_id: int
     query: str
+    query_embedding: Optional[List[float]]
     messages: Annotated[List[AnyMessage], add_messages]
     core_memories: List[str]
     recall_memories: List[str]
+    timestamp: str
     answer: str
-
-    def __setitem__(self, key, value):
-        logger.debug(f"Установлено значение '{key}' = '{value}' в State.")
-        super().__setitem__(key, value)
-
-    def __getitem__(self, key):
-        value = super().__getitem__(key)
-        logger.debug(f"Получено значение '{key}' = '{value}' из State.")
-        return value
+    # Бюджет хода: число вызовов LLM, итераций инструментов и дедлайн по time.monotonic()
+    llm_calls: int
+    tool_iterations: int
+    deadline: float
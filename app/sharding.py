@@ -0,0 +1,142 @@
+# app/sharding.py
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher, types
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Типы обновлений, в которых отправитель лежит в поле from
+USER_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+# Номер текущего процесса-обработчика (None во входном процессе и вне многопроцессного режима)
+worker_index: Optional[int] = None
+
+def shard_for_update(data: dict, shards: int) -> int:
+    """Номер процесса-обработчика для обновления: все обновления пользователя попадают в один процесс."""
+    for field in USER_UPDATE_FIELDS:
+        payload = data.get(field)
+        if payload:
+            telegram_id = (payload.get("from") or payload.get("chat") or {}).get("id", 0)
+            return telegram_id % shards
+    return 0
+
+def _worker_main(
+    index: int,
+    queue: multiprocessing.Queue,
+    create_dispatcher: Callable[[], Dispatcher],
+    on_startup: Optional[Callable[[Dispatcher], Awaitable]],
+    on_shutdown: Optional[Callable[[Dispatcher], Awaitable]],
+):
+    # Процесс-обработчик: свои подключения к базе, векторное хранилище и кэши
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, queue, create_dispatcher, on_startup, on_shutdown))
+
+async def _run_worker(index, queue, create_dispatcher, on_startup, on_shutdown):
+    global worker_index
+    worker_index = index
+    dp = create_dispatcher()
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    if on_startup:
+        await on_startup(dp)
+    logger.info("Обработчик %s запущен.", index)
+
+    loop = asyncio.get_running_loop()
+    # Семафор ограничивает разбор обновлений: текстовые сообщения обработчик передаёт в очередь
+    # ходов и не ждёт хода, поэтому сообщения, ожидающие хода пользователя, слоты не держат.
+    # Одновременные ходы ограничивает UserTurnDispatcher, их завершения ждёт on_shutdown
+    semaphore = asyncio.Semaphore(Config.SHARD_WORKER_CONCURRENCY)
+    tasks = set()
+
+    async def process(data: dict):
+        try:
+            await dp.process_update(types.Update(**data))
+        except Exception as e:
+            logger.exception("Ошибка при обработке обновления в обработчике %s: %s", index, e)
+        finally:
+            semaphore.release()
+
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            break
+        await semaphore.acquire()
+        task = asyncio.create_task(process(data))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if on_shutdown:
+        await on_shutdown(dp)
+    await dp.bot.session.close()
+    logger.info("Обработчик %s остановлен.", index)
+
+class ShardedRunner:
+    """Входной процесс, распределяющий обновления по процессам-обработчикам.
+
+    Обновления получаются поллингом и направляются в процесс telegram_id % shards,
+    поэтому порядок сообщений пользователя и кэши внутри процесса остаются корректными.
+    Очереди к обработчикам ограничены SHARD_QUEUE_SIZE: при заполнении входной
+    процесс перестаёт забирать новые обновления.
+    """
+
+    def __init__(self, create_dispatcher, on_startup=None, on_shutdown=None, shards: int = Config.SHARD_WORKERS):
+        self.shards = shards
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue(maxsize=Config.SHARD_QUEUE_SIZE) for _ in range(shards)]
+        self.processes = [
+            context.Process(
+                target=_worker_main,
+                args=(index, queue, create_dispatcher, on_startup, on_shutdown),
+                name=f"bot-worker-{index}",
+            )
+            for index, queue in enumerate(self.queues)
+        ]
+
+    async def route(self, data: dict):
+        queue = self.queues[shard_for_update(data, self.shards)]
+        # put блокируется при заполненной очереди, поэтому выполняется в пуле потоков
+        await asyncio.get_running_loop().run_in_executor(None, queue.put, data)
+
+    async def poll(self):
+        bot = Bot(token=Config.BOT_TOKEN)
+        await bot.delete_webhook()
+        offset = None
+        try:
+            while True:
+                updates = await bot.get_updates(offset=offset, timeout=Config.SHARD_POLLING_TIMEOUT)
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.route(update.to_python())
+        finally:
+            await bot.session.close()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        for process in self.processes:
+            process.start()
+        logger.info("Запущено %s процессов-обработчиков.", self.shards)
+        try:
+            asyncio.run(self.poll())
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("Остановка входного процесса.")
+        finally:
+            for queue in self.queues:
+                queue.put(None)
+            for process in self.processes:
+                process.join()
+
+def run_sharded(create_dispatcher, on_startup=None, on_shutdown=None):
+    ShardedRunner(create_dispatcher, on_startup=on_startup, on_shutdown=on_shutdown).run()
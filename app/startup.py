@@ -0,0 +1,55 @@
+# app/startup.py
+
+import asyncio
+import importlib
+import logging
+import time
+
+from sqlalchemy import text
+
+from .config import Config
+from .database import engine
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+startup_phase_seconds = registry.gauge("startup_phase_seconds", "Длительность фаз запуска процесса.")
+
+async def warm_up_database(connections: int = Config.STARTUP_WARM_CONNECTIONS) -> None:
+    """Открывает несколько соединений пула заранее, чтобы первые ходы не ждали подключения."""
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(max(1, connections))))
+
+async def warm_up(build_graphs: bool = Config.STARTUP_BUILD_GRAPHS) -> dict:
+    """Готовит процесс к приёму обновлений, выполняя независимые фазы одновременно.
+
+    Пока открываются соединения с базой, в отдельном потоке импортируются LangChain,
+    LangGraph и модули агента; затем параллельно инициализируется векторное хранилище
+    и собирается граф. Возвращает длительность каждой фазы в секундах.
+    """
+    phases = {}
+
+    async def phase(name: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            phases[name] = time.perf_counter() - started
+            startup_phase_seconds.set(phases[name], phase=name)
+
+    async def prepare_agent():
+        llm_graph = await phase("agent_imports", asyncio.to_thread(importlib.import_module, "app.llm_graph"))
+        from .vectorstore import get_vectorstores
+        tasks = [phase("vectorstore", get_vectorstores())]
+        if build_graphs:
+            tasks.append(phase("graphs", asyncio.to_thread(llm_graph.build_graphs)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(
+        phase("database", warm_up_database()),
+        prepare_agent(),
+    )
+    return phases
@@ -2,16 +2,12 @@
 
 import logging
 from langchain_core.tools import tool
-from langchain_core.documents import Document
-from ..utils import ensure_configurable
-from ..database import async_session
-from ..models import Memory
-from ..vectorstore import get_vectorstores
+from ..utils import ensure_configurable, save_core_memory
+from ..config import Config
+from ..vectorstore import search_user_facts, add_recall_memories
+from ..write_queue import memory_write_queue
 from langchain_core.runnables.config import RunnableConfig
-import uuid
-from sqlalchemy import select
 from typing import Optional
-import json
 
 logger = logging.getLogger(__name__)
 
@@ -29,31 +25,22 @@ async def save_recall_memory(memory: str, config: RunnableConfig, timestamp:Opti
     try:
         configurable = ensure_configurable(config)
         user_id = configurable["user_id"]
-        
-        vectorstores = await get_vectorstores()
-        user_facts_vectorstore = vectorstores["user_facts"]
-        if timestamp:
-            doc = Document(
-                page_content=memory,
-                metadata={
-                    "user_id": user_id,
-                    "fact_id": str(uuid.uuid4()),
-                    "timestamp":timestamp
-                }
-            )
-        else:
-            doc = Document(
-                page_content=memory,
-                metadata={
-                    "user_id": user_id,
-                    "fact_id": str(uuid.uuid4())
-                }
-            )
-        
-        await user_facts_vectorstore.aadd_documents([doc])
-        logger.info(f"Recall память успешно сохранена для пользователя {user_id}.")
+
+        item = {"memory": memory, "timestamp": timestamp}
+        if Config.MEMORY_WRITE_BEHIND:
+            await memory_write_queue.enqueue(user_id, "recall", item)
+            logger.info("Recall память поставлена в очередь записи для пользователя %s.", user_id)
+            return "Memory saved successfully"
+
+        # Сообщение пользователя сохраняется как есть - используем уже посчитанный вектор
+        known_embeddings = {}
+        if memory == configurable["query"] and configurable["query_embedding"]:
+            known_embeddings[memory] = configurable["query_embedding"]
+        await add_recall_memories(user_id, [item], known_embeddings=known_embeddings)
+        logger.info("Recall память успешно сохранена для пользователя %s.", user_id)
         return "Memory saved successfully"
     except Exception as e:
+        logger.exception("Ошибка при сохранении recall памяти: %s", e)
         return "Failed to save memory"
 
 @tool
@@ -71,32 +58,27 @@ async def search_memory(query: str, config: RunnableConfig, top_k: int = 5) -> l
         configurable = ensure_configurable(config)
         user_id = configurable["user_id"]
         
-        vectorstores = await get_vectorstores()
-        user_facts_vectorstore = vectorstores["user_facts"]
-        
-        results = await user_facts_vectorstore.asimilarity_search(
-            query=query,
-            k=top_k,
-            filter=f"(langchain_metadata->>'user_id')::int = {user_id}"
-        )
-        memories = []
-        for doc in results:
-            if "timestamp" in doc.metadata:
-                memories.append(doc.page_content + f" Timestamp:{doc.metadata['timestamp']}")
-            else:
-                memories.append(doc.page_content)
-        logger.info(f"Найдено {len(memories)} recall памяти для пользователя {user_id}.")
+        # Вектор сообщения пользователя уже посчитан в графе, повторно его не запрашиваем
+        embedding = configurable["query_embedding"] if query == configurable["query"] else None
+        memories = await search_user_facts(user_id, query, k=top_k, embedding=embedding)
+        logger.info("Найдено %s recall памяти для пользователя %s.", len(memories), user_id)
         return memories
     except Exception as e:
         return []
 
 @tool
-async def store_core_memory(memory: str, config: RunnableConfig, index: Optional[int] = None) -> str:
+async def store_core_memory(
+    memory: str,
+    config: RunnableConfig,
+    memory_id: Optional[int] = None,
+    priority: Optional[int] = None
+) -> str:
     """Store a core memory.
 
     Args:
         memory (str): core memory to store
-        index (Optional[int], optional): position of memory in the list to replace. Defaults to None.
+        memory_id (Optional[int], optional): id of an existing core memory (shown in square brackets) to replace. Defaults to None - a new memory is added.
+        priority (Optional[int], optional): importance of the memory, higher values are shown first. Defaults to None - 0 for new memories, unchanged for updates.
 
     Returns:
         str: status of operation
@@ -105,27 +87,17 @@ async def store_core_memory(memory: str, config: RunnableConfig, index: Optional
         configurable = ensure_configurable(config)
         user_id = configurable["user_id"]
         
-        async with async_session() as session:
-            result = await session.execute(select(Memory).where(Memory.user_id == user_id))
-            user_memory = result.scalars().first()
-            
-            if user_memory:
-                facts = json.loads(user_memory.facts)
-                if index is not None and 0 <= index < len(facts):
-                    logger.debug(f"Обновление core памяти на позиции {index} для пользователя {user_id}.")
-                    facts[index] = memory
-                else:
-                    logger.debug(f"Добавление новой core памяти для пользователя {user_id}.")
-                    facts.insert(0, memory)
-                user_memory.facts = json.dumps(facts)
-            else:
-                logger.debug(f"Создание новой core памяти для пользователя {user_id}.")
-                user_memory = Memory(user_id=user_id, facts=json.dumps([memory]))
-                session.add(user_memory)
-            
-            await session.commit()
+        if Config.MEMORY_WRITE_BEHIND:
+            await memory_write_queue.enqueue(
+                user_id, "core", {"memory": memory, "memory_id": memory_id, "priority": priority}
+            )
+            logger.info("Core память поставлена в очередь записи для пользователя %s.", user_id)
+            return "Core memory stored successfully"
+
+        saved_id = await save_core_memory(user_id, memory, memory_id, priority)
         
-        logger.info(f"Core память успешно сохранена для пользователя {user_id}.")
-        return "Core memory stored successfully"
+        logger.info("Core память успешно сохранена для пользователя %s.", user_id)
+        return f"Core memory stored successfully with id {saved_id}"
     except Exception as e:
+        logger.exception("Ошибка при сохранении core памяти: %s", e)
         return "Failed to store core memory"
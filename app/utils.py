@@ -1,110 +1,245 @@
 # app/utils.py
-from langchain_core.runnables import RunnableConfig
-from .schemas.state import GraphConfig
+from typing import TYPE_CHECKING
 from sqlalchemy.future import select
 from .database import async_session
 from .models import User
 import logging
-from .models import MessageHistory, Memory
-from sqlalchemy import select
+from .models import Message, CoreMemory
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
 from .database import async_session
+from .config import Config
+from .cache import LRUCache
 from datetime import datetime
-import json
+from functools import lru_cache
+import time
+from .metrics import registry, timed
+from .logging_config import redact
+
+# LangChain и LangGraph нужны только агенту; обработчики импортируют этот модуль
+# при старте, поэтому тяжёлые зависимости подгружаются при первом использовании
+if TYPE_CHECKING:
+    from langchain_core.messages import AnyMessage
+    from langchain_core.runnables import RunnableConfig
+    from .schemas.state import GraphConfig
 logger = logging.getLogger(__name__)
 
 DEFAULT_CATALOG_NAME = "Default Catalog"
 
+# Соответствие telegram_id -> пользователь не меняется после создания, поэтому кэшируется;
+# имя пользователя сверяется с Telegram не чаще раза в USER_CACHE_TTL секунд
+_user_cache = LRUCache(Config.USER_CACHE_SIZE)
+
+db_latency = registry.histogram("db_operation_seconds", "Время операций с базой данных.")
+db_errors = registry.counter("db_operation_errors_total", "Ошибки операций с базой данных.")
+
+@timed(db_latency, db_errors, operation="get_or_create_user")
 async def get_or_create_user(telegram_id: int, username: str = None) -> User:
-    logger.debug(f"Получение или создание пользователя с Telegram ID {telegram_id}.")
+    logger.debug("Получение или создание пользователя с Telegram ID %s.", telegram_id)
+    cached = _user_cache.get(telegram_id)
+    if cached is not None:
+        user, refreshed_at = cached
+        if user.username == username or time.monotonic() - refreshed_at < Config.USER_CACHE_TTL:
+            return user
+
     async with async_session() as session:
         try:
-            result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-            user = result.scalars().first()
-            if not user:
-                logger.info(f"Создание нового пользователя с Telegram ID {telegram_id}.")
-                user = User(telegram_id=telegram_id, username=username)
-                session.add(user)
+            if cached is not None:
+                # Пользователь уже известен, но сменил имя - обновляем только его
+                user = cached[0]
+                await session.execute(update(User).where(User.id == user.id).values(username=username))
                 await session.commit()
-                await session.refresh(user)
-                logger.info(f"Создан пользователь {telegram_id}")
+                user.username = username
+                logger.debug("Обновлено имя пользователя %s.", telegram_id)
             else:
-                logger.debug(f"Пользователь {telegram_id} найден с ID {user.id}.")
+                # Одна вставка без гонки: при одновременном первом сообщении второй запрос ничего не вставит
+                result = await session.execute(
+                    insert(User)
+                    .values(telegram_id=telegram_id, username=username, created_at=datetime.utcnow())
+                    .on_conflict_do_nothing(index_elements=[User.telegram_id])
+                    .returning(User)
+                )
+                user = result.scalars().first()
+                await session.commit()
+                if user:
+                    logger.info("Создан пользователь %s", telegram_id)
+                else:
+                    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+                    user = result.scalars().first()
+                    logger.debug("Пользователь %s найден с ID %s.", telegram_id, user.id)
+            _user_cache.set(telegram_id, (user, time.monotonic()))
             return user
         except Exception as e:
-            logger.exception(f"Ошибка при получении или создании пользователя с Telegram ID {telegram_id}: {e}")
+            logger.exception("Ошибка при получении или создании пользователя с Telegram ID %s: %s", telegram_id, e)
             raise
 
 from sqlalchemy.orm import selectinload
 
+@timed(db_latency, db_errors, operation="add_message_to_history")
 async def add_message_to_history(user_id: int, role: str, content: str):
-    logger.debug(f"Добавление сообщения в историю пользователя {user_id}: {role} - {content}")
+    logger.debug("Добавление сообщения в историю пользователя %s: %s - %s", user_id, role, redact(content))
     async with async_session() as session:
         try:
-            history = await session.execute(select(MessageHistory).where(MessageHistory.user_id == user_id))
-            history = history.scalars().first()
-            
-            new_message = {
-                "role": role,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            if history:
-                messages = json.loads(history.messages)
-                messages.append(new_message)
-                history.messages = json.dumps(messages)
-                history.updated_at = datetime.utcnow()
-                logger.debug(f"Сообщение добавлено в существующую историю пользователя {user_id}.")
-            else:
-                history = MessageHistory(user_id=user_id, messages=json.dumps([new_message]))
-                session.add(history)
-                logger.debug(f"Создана новая история сообщений для пользователя {user_id}.")
+            session.add(Message(user_id=user_id, role=role, content=content, created_at=datetime.utcnow()))
             await session.commit()
-            logger.info(f"История сообщений для пользователя {user_id} обновлена.")
+            logger.info("История сообщений для пользователя %s обновлена.", user_id)
         except Exception as e:
-            logger.exception(f"Ошибка при добавлении сообщения в историю для пользователя {user_id}: {e}")
+            logger.exception("Ошибка при добавлении сообщения в историю для пользователя %s: %s", user_id, e)
+            db_errors.inc(operation="add_message_to_history")
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(Config.TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning("Токенизатор %s недоступен, используется приближённый подсчёт: %s", Config.TOKENIZER_ENCODING, e)
+        return None
+
+def count_tokens(text: str) -> int:
+    """Считает количество токенов в тексте.
+
+    Если словарь токенизатора не удалось загрузить, считается примерно по 4 символа на токен.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text or "") // 4 + 1
+    return len(encoding.encode(text or ""))
+
+@timed(db_latency, db_errors, operation="get_message_history")
+async def get_message_history(user_id: int, limit: int = None):
+    """Возвращает историю сообщений пользователя в хронологическом порядке.
 
-async def get_message_history(user_id: int):
-    logger.debug(f"Получение истории сообщений для пользователя {user_id}.")
+    При заданном limit читаются только последние limit сообщений по индексу (user_id, created_at).
+    """
+    logger.debug("Получение истории сообщений для пользователя %s.", user_id)
     async with async_session() as session:
         try:
-            history = await session.execute(select(MessageHistory).where(MessageHistory.user_id == user_id))
-            history = history.scalars().first()
-            messages = json.loads(history.messages) if history else []
-            logger.debug(f"История сообщений для пользователя {user_id} получена успешно. Количество сообщений: {len(messages)}.")
+            query = (
+                select(Message)
+                .where(Message.user_id == user_id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+            )
+            if limit is not None:
+                query = query.limit(limit)
+            result = await session.execute(query)
+            messages = [
+                {
+                    "role": msg.role,
+                    "content": msg.content,
+                    "timestamp": msg.created_at.isoformat()
+                }
+                for msg in reversed(result.scalars().all())
+            ]
+            logger.debug("История сообщений для пользователя %s получена успешно. Количество сообщений: %s.", user_id, len(messages))
             return messages
         except Exception as e:
-            logger.exception(f"Ошибка при получении истории сообщений для пользователя {user_id}: {e}")
+            logger.exception("Ошибка при получении истории сообщений для пользователя %s: %s", user_id, e)
+            db_errors.inc(operation="get_message_history")
             return []
 
-async def get_memories(user_id: int):
-    logger.debug(f"Получение памяти для пользователя {user_id}.")
+def trim_messages_to_budget(messages: list, max_tokens: int) -> list:
+    """Оставляет самые свежие сообщения, суммарно укладывающиеся в max_tokens токенов.
+
+    Последнее сообщение сохраняется всегда, даже если само превышает бюджет.
+    """
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += count_tokens(messages[i]["content"])
+        if used > max_tokens and i < len(messages) - 1:
+            break
+        start = i
+    return messages[start:]
+
+@timed(db_latency, db_errors, operation="get_memories")
+async def get_memories(user_id: int, limit: int = Config.CORE_MEMORY_MAX_FACTS) -> list[dict]:
+    """Core факты пользователя по рангу: сначала с большим приоритетом, затем недавно обновлённые.
+
+    Фактам без token_count (перенесённым миграцией) он считается и сохраняется при первом чтении.
+    """
+    logger.debug("Получение памяти для пользователя %s.", user_id)
     async with async_session() as session:
         try:
-            memory = await session.execute(select(Memory).where(Memory.user_id == user_id))
-            memory = memory.scalars().first()
-            facts = json.loads(memory.facts) if memory else []
-            logger.debug(f"Память для пользователя {user_id} получена: {facts}")
+            result = await session.execute(
+                select(CoreMemory.id, CoreMemory.content, CoreMemory.priority, CoreMemory.token_count)
+                .where(CoreMemory.user_id == user_id)
+                .order_by(CoreMemory.priority.desc(), CoreMemory.updated_at.desc())
+                .limit(limit)
+            )
+            facts = [
+                {"id": row.id, "content": row.content, "priority": row.priority, "token_count": row.token_count}
+                for row in result
+            ]
+            uncounted = [fact for fact in facts if fact["token_count"] is None]
+            if uncounted:
+                for fact in uncounted:
+                    fact["token_count"] = count_tokens(fact["content"])
+                await session.execute(
+                    update(CoreMemory),
+                    [{"id": fact["id"], "token_count": fact["token_count"]} for fact in uncounted]
+                )
+                await session.commit()
+            logger.debug("Память для пользователя %s получена: %s", user_id, redact(facts))
             return facts
         except Exception as e:
-            logger.exception(f"Ошибка при получении памяти для пользователя {user_id}: {e}")
+            logger.exception("Ошибка при получении памяти для пользователя %s: %s", user_id, e)
+            db_errors.inc(operation="get_memories")
             return []
 
-def ensure_configurable(config: RunnableConfig) -> GraphConfig:
+@timed(db_latency, db_errors, operation="save_core_memory")
+async def save_core_memory(user_id: int, memory: str, memory_id: int = None, priority: int = None) -> int:
+    """Обновляет core факт memory_id или добавляет новый, возвращает id факта.
+
+    Если факта memory_id у пользователя нет, добавляется новый. Факты не удаляются:
+    в промпт попадают только CORE_MEMORY_MAX_FACTS старших по рангу (см. get_memories).
+    """
+    async with async_session() as session:
+        fact_id = await write_core_memory(session, user_id, memory, memory_id, priority)
+        await session.commit()
+        return fact_id
+
+async def write_core_memory(session, user_id: int, memory: str, memory_id: int = None, priority: int = None) -> int:
+    """То же, что save_core_memory, но в транзакции переданной сессии и без commit."""
+    now = datetime.utcnow()
+    values = {"content": memory, "token_count": count_tokens(memory), "updated_at": now}
+    if priority is not None:
+        values["priority"] = priority
+    if memory_id is not None:
+        result = await session.execute(
+            update(CoreMemory)
+            .where(CoreMemory.id == memory_id, CoreMemory.user_id == user_id)
+            .values(**values)
+            .returning(CoreMemory.id)
+        )
+        updated_id = result.scalar()
+        if updated_id is not None:
+            logger.debug("Обновление core памяти %s для пользователя %s.", memory_id, user_id)
+            return updated_id
+
+    logger.debug("Добавление новой core памяти для пользователя %s.", user_id)
+    result = await session.execute(
+        insert(CoreMemory)
+        .values(user_id=user_id, created_at=now, **{"priority": 0, **values})
+        .returning(CoreMemory.id)
+    )
+    return result.scalar()
+
+def ensure_configurable(config: "RunnableConfig") -> "GraphConfig":
     """Merge the user-provided config with default values."""
     configurable = config.get("configurable", {})
-    logger.debug(f"Объединение конфигурации: {configurable}")
+    logger.debug("Объединение конфигурации для пользователя %s.", configurable.get("user_id"))
     return {
         **configurable,
-        **GraphConfig(
-            user_id=configurable["user_id"],
-        ),
+        "user_id": configurable["user_id"],
+        "query": configurable.get("query"),
+        "query_embedding": configurable.get("query_embedding"),
     }
 
 
-from langchain_core.messages import HumanMessage, AIMessage, AnyMessage
-
-def map_role_to_message(msg: dict) -> AnyMessage:
+def map_role_to_message(msg: dict) -> "AnyMessage":
     """Преобразует сообщение с учетом роли."""
+    from langchain_core.messages import HumanMessage, AIMessage
     role = msg.get("role", "").lower()
     content = msg.get("content", "")
     if role == "human":
@@ -1,70 +1,246 @@
 # app/vectorstore.py
 
 import logging
-from langchain_openai import OpenAIEmbeddings
 from langchain_google_cloud_sql_pg.engine import PostgresEngine
 from langchain_google_cloud_sql_pg.vectorstore import AsyncPostgresVectorStore
-from sqlalchemy.ext.asyncio import create_async_engine
+from langchain_google_cloud_sql_pg.indexes import HNSWIndex, HNSWQueryOptions, IVFFlatIndex, IVFFlatQueryOptions
+from langchain_google_cloud_sql_pg import Column
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import text, bindparam, func, Table, MetaData, Column as SAColumn, Integer, Text, DateTime, JSON
+from sqlalchemy.dialects.postgresql import UUID, insert
 from .config import Config
+from .database import get_vector_engine
+from .embeddings import CachedEmbeddings
+from .llm import create_embeddings
 import asyncio
+import uuid
 
 logger = logging.getLogger(__name__)
 
-async def init_vectorstore():
+USER_FACTS_TABLE = "user_facts_vector_store"
+USER_FACTS_INDEX = "user_facts_vector_store_embedding_idx"
+# Поля метаданных, вынесенные в отдельные типизированные колонки таблицы
+USER_FACTS_METADATA_COLUMNS = ["user_id", "timestamp"]
+
+# Описание таблицы для пакетной вставки в обход построчного aadd_embeddings
+user_facts_table = Table(
+    USER_FACTS_TABLE,
+    MetaData(),
+    SAColumn("langchain_id", UUID(as_uuid=True), primary_key=True),
+    SAColumn("content", Text, nullable=False),
+    SAColumn("embedding", Vector(Config.EMBEDDING_DIMENSIONS), nullable=False),
+    SAColumn("user_id", Integer),
+    SAColumn("timestamp", Text),
+    SAColumn("langchain_metadata", JSON),
+    SAColumn("created_at", DateTime, server_default=func.now()),
+    schema="public",
+)
+
+def get_vector_index():
+    """Описание ANN-индекса по эмбеддингам с параметрами из конфигурации."""
+    if Config.VECTOR_INDEX_TYPE == "ivfflat":
+        return IVFFlatIndex(name=USER_FACTS_INDEX, lists=Config.IVFFLAT_LISTS)
+    return HNSWIndex(name=USER_FACTS_INDEX, m=Config.HNSW_M, ef_construction=Config.HNSW_EF_CONSTRUCTION)
+
+def get_index_query_options():
+    """Параметры поиска по индексу (ef_search для HNSW, probes для IVFFlat)."""
+    if Config.VECTOR_INDEX_TYPE == "ivfflat":
+        return IVFFlatQueryOptions(probes=Config.IVFFLAT_PROBES)
+    return HNSWQueryOptions(ef_search=Config.HNSW_EF_SEARCH)
+
+async def table_exists(engine, table_name: str, schema_name: str = "public") -> bool:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT to_regclass(:name)"),
+            {"name": f"{schema_name}.{table_name}"}
+        )
+        return result.scalar() is not None
+
+async def init_vectorstore(engine=None):
+    """Создаёт векторное хранилище на engine (по умолчанию - общий движок векторного хранилища)."""
     logger.debug("Инициализация векторного хранилища.")
     try:
-        engine = create_async_engine(Config.PGVECTOR_URL, echo=False)
-        pg_engine = PostgresEngine.from_engine(
-            engine=engine,
-            loop=asyncio.get_event_loop()
-        )
+        engine = engine or get_vector_engine()
+        pg_engine = PostgresEngine.from_engine(engine=engine)
 
-        embedding_service = OpenAIEmbeddings(
-            api_key=Config.OPENAI_API_KEY,
-            base_url=Config.OPENAI_BASE_PROVIDER,
-            model="text-embedding-3-small",
-            dimensions=1024
+        embedding_service = CachedEmbeddings(
+            create_embeddings(),
+            namespace=f"{Config.EMBEDDING_MODEL}:{Config.EMBEDDING_DIMENSIONS}"
         )
 
-        # Инициализация таблицы для пользовательских фактов
-        await pg_engine.ainit_vectorstore_table(
-            table_name="user_facts_vector_store",
-            vector_size=embedding_service.dimensions,
-            schema_name="public",
-            content_column="content",
-            embedding_column="embedding",
-            id_column="langchain_id",
-            metadata_json_column="langchain_metadata",
-            overwrite_existing=True
-        )
-        logger.info("Таблица user_facts_vector_store инициализирована.")
+        # Таблица создаётся миграцией; создание при старте - только по явному
+        # VECTORSTORE_CREATE_TABLE (например, для локальной пустой базы)
+        if Config.VECTORSTORE_CREATE_TABLE and not await table_exists(engine, USER_FACTS_TABLE):
+            await pg_engine.ainit_vectorstore_table(
+                table_name=USER_FACTS_TABLE,
+                vector_size=Config.EMBEDDING_DIMENSIONS,
+                schema_name="public",
+                content_column="content",
+                embedding_column="embedding",
+                id_column="langchain_id",
+                metadata_columns=[
+                    Column("user_id", "INTEGER"),
+                    Column("timestamp", "TEXT"),
+                ],
+                metadata_json_column="langchain_metadata",
+                overwrite_existing=False
+            )
+            # Колонки и индекс, которые в базах из миграций добавляет c51e0b7f3a96
+            async with engine.begin() as conn:
+                await conn.execute(text(
+                    f"ALTER TABLE public.{USER_FACTS_TABLE} ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT now()"
+                ))
+                await conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{USER_FACTS_TABLE}_user_id ON public.{USER_FACTS_TABLE} (user_id)"
+                ))
+            logger.info("Таблица %s создана.", USER_FACTS_TABLE)
 
         user_facts_vectorstore = await AsyncPostgresVectorStore.create(
             engine=pg_engine,
             embedding_service=embedding_service,
-            table_name="user_facts_vector_store",
+            table_name=USER_FACTS_TABLE,
             schema_name="public",
             content_column="content",
             embedding_column="embedding",
             id_column="langchain_id",
-            metadata_json_column="langchain_metadata"
+            metadata_columns=USER_FACTS_METADATA_COLUMNS,
+            metadata_json_column="langchain_metadata",
+            index_query_options=get_index_query_options()
         )
         logger.info("Векторное хранилище для пользовательских фактов создано.")
 
         return {
-            "user_facts": user_facts_vectorstore
+            "user_facts": user_facts_vectorstore,
+            "embeddings": embedding_service,
+            "engine": engine
         }
     except Exception as e:
-        logger.exception(f"Ошибка при инициализации векторного хранилища: {e}")
+        logger.exception("Ошибка при инициализации векторного хранилища: %s", e)
         raise
 
+async def build_vector_index(rebuild: bool = False, engine=None):
+    """Создаёт ANN-индекс по эмбеддингам, при rebuild пересоздаёт его с текущими параметрами.
+
+    engine - отдельный движок для долгих операций (например, без statement_timeout).
+    """
+    vectorstores = await init_vectorstore(engine) if engine is not None else await get_vectorstores()
+    user_facts_vectorstore = vectorstores["user_facts"]
+    index = get_vector_index()
+    if rebuild:
+        logger.info("Удаление индекса %s.", USER_FACTS_INDEX)
+        await user_facts_vectorstore.adrop_vector_index(USER_FACTS_INDEX)
+    elif await user_facts_vectorstore.is_valid_index(USER_FACTS_INDEX):
+        logger.info("Индекс %s уже существует.", USER_FACTS_INDEX)
+        return
+    logger.info("Построение индекса %s (%s).", USER_FACTS_INDEX, index.index_type)
+    await user_facts_vectorstore.aapply_vector_index(index, concurrently=True)
+    logger.info("Индекс %s построен.", USER_FACTS_INDEX)
+
+def format_recall_memory(content: str, timestamp: str = None) -> str:
+    if timestamp:
+        return content + f" Timestamp:{timestamp}"
+    return content
+
+async def embed_query(query: str) -> list[float]:
+    vectorstores = await get_vectorstores()
+    return await vectorstores["embeddings"].aembed_query(query)
+
+async def search_user_facts(user_id: int, query: str = None, k: int = 5, embedding: list[float] = None) -> list[str]:
+    """Поиск recall памяти пользователя по близости эмбеддингов.
+
+    Если передан готовый embedding, текст запроса повторно не векторизуется.
+    Фильтр по типизированной колонке user_id использует btree-индекс,
+    все значения передаются параметрами запроса.
+    """
+    vectorstores = await get_vectorstores()
+    if embedding is None:
+        embedding = await vectorstores["embeddings"].aembed_query(query)
+
+    if Config.VECTOR_INDEX_TYPE == "ivfflat":
+        search_option = f"SET LOCAL ivfflat.probes = {int(Config.IVFFLAT_PROBES)}"
+    else:
+        search_option = f"SET LOCAL hnsw.ef_search = {int(Config.HNSW_EF_SEARCH)}"
+    stmt = text(f"""
+        SELECT content, "timestamp"
+        FROM public.{USER_FACTS_TABLE}
+        WHERE user_id = :user_id
+        ORDER BY embedding <=> CAST(:embedding AS vector)
+        LIMIT :k
+    """).bindparams(bindparam("embedding", type_=Vector(Config.EMBEDDING_DIMENSIONS)))
+
+    async with vectorstores["engine"].begin() as conn:
+        await conn.execute(text(search_option))
+        result = await conn.execute(stmt, {"user_id": user_id, "embedding": embedding, "k": k})
+        return [format_recall_memory(row.content, row.timestamp) for row in result]
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _embed_in_batches(embeddings, texts: list[str]) -> list[list[float]]:
+    # Провайдер ограничивает число текстов в одном запросе, пачки отправляются параллельно
+    semaphore = asyncio.Semaphore(Config.EMBEDDING_BATCH_CONCURRENCY)
+
+    async def embed(batch):
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+
+    batches = await asyncio.gather(*(embed(batch) for batch in _chunks(texts, Config.EMBEDDING_BATCH_SIZE)))
+    return [vector for batch in batches for vector in batch]
+
+async def bulk_add_recall_memories(items: list[dict], known_embeddings: dict = None, engine=None) -> int:
+    """Пакетная запись recall фактов, в том числе разных пользователей.
+
+    items - словари с ключами user_id, memory и (опционально) timestamp и id.
+    Тексты векторизуются пачками по EMBEDDING_BATCH_SIZE (уже известные векторы берутся
+    из known_embeddings), строки вставляются многострочными INSERT в одной транзакции.
+    Факты с переданным id, который уже есть в таблице, пропускаются, так что повторная
+    запись того же пакета не создаёт дубликатов.
+    engine - отдельный движок для вставки (например, без statement_timeout при импорте).
+    """
+    if not items:
+        return 0
+    vectorstores = await get_vectorstores()
+    known_embeddings = known_embeddings or {}
+
+    missing = list(dict.fromkeys(item["memory"] for item in items if item["memory"] not in known_embeddings))
+    embedded = dict(zip(missing, await _embed_in_batches(vectorstores["embeddings"], missing))) if missing else {}
+
+    rows = [
+        {
+            "langchain_id": item.get("id") or uuid.uuid4(),
+            "content": item["memory"],
+            "embedding": known_embeddings.get(item["memory"]) or embedded[item["memory"]],
+            "user_id": item["user_id"],
+            "timestamp": item.get("timestamp"),
+            "langchain_metadata": {"fact_id": str(uuid.uuid4())},
+        }
+        for item in items
+    ]
+    async with (engine or vectorstores["engine"]).begin() as conn:
+        for batch in _chunks(rows, Config.RECALL_INSERT_BATCH_SIZE):
+            await conn.execute(
+                insert(user_facts_table).values(batch).on_conflict_do_nothing(index_elements=["langchain_id"])
+            )
+    logger.debug("Записано %s recall фактов.", len(rows))
+    return len(rows)
+
+async def add_recall_memories(user_id: int, memories: list[dict], known_embeddings: dict = None) -> None:
+    """Сохраняет несколько фактов одного пользователя, см. bulk_add_recall_memories."""
+    await bulk_add_recall_memories(
+        [{**item, "user_id": user_id} for item in memories],
+        known_embeddings=known_embeddings
+    )
+
 vectorstores = None
+_vectorstores_lock = asyncio.Lock()
 
 async def get_vectorstores():
     global vectorstores
     if vectorstores is None:
-        logger.debug("Получение векторных хранилищ.")
-        vectorstores = await init_vectorstore()
-    else:
-        logger.debug("Векторные хранилища уже инициализированы.")
+        # Прогрев на старте и первый запрос не должны инициализировать хранилище дважды
+        async with _vectorstores_lock:
+            if vectorstores is None:
+                logger.debug("Получение векторных хранилищ.")
+                vectorstores = await init_vectorstore()
     return vectorstores
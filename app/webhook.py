@@ -0,0 +1,125 @@
+# app/webhook.py
+
+import asyncio
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from .config import Config
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+updates_received = registry.counter("bot_updates_received_total", "Обновления, принятые webhook-сервером.")
+updates_rejected = registry.counter("bot_updates_rejected_total", "Обновления, отклонённые из-за переполнения очереди.")
+updates_processed = registry.counter("bot_updates_processed_total", "Обработанные обновления по результату.")
+update_latency = registry.histogram("bot_update_processing_seconds", "Время обработки одного обновления.")
+update_queue_wait = registry.histogram("bot_update_queue_wait_seconds", "Время ожидания обновления в очереди.")
+queue_depth = registry.gauge("bot_update_queue_depth", "Обновления, ожидающие обработчика.")
+inflight_updates = registry.gauge("bot_updates_in_flight", "Обновления, обрабатываемые в данный момент.")
+
+class WebhookServer:
+    """Webhook-сервер с ограниченным пулом обработчиков.
+
+    Принятые обновления кладутся в очередь длиной max_pending и обрабатываются
+    workers задачами. Когда очередь заполнена, сервер отвечает 503, и Telegram
+    повторяет доставку позже - так нагрузка не накапливается внутри процесса.
+    Текстовые сообщения обработчик только передаёт в очередь ходов пользователя
+    (см. UserTurnDispatcher), поэтому серия сообщений одного пользователя не занимает
+    обработчики, пока выполняется его ход.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        workers: int = Config.WEBHOOK_WORKERS,
+        max_pending: int = Config.WEBHOOK_MAX_PENDING_UPDATES,
+        on_startup=None,
+        on_shutdown=None,
+    ):
+        self.dp = dp
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self._tasks = []
+        queue_depth.set_function(self.queue.qsize)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if Config.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != Config.WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            logger.warning("Тело обновления не является корректным JSON, обновление отклонено.")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((asyncio.get_running_loop().time(), data))
+        except asyncio.QueueFull:
+            updates_rejected.inc()
+            logger.warning("Очередь обновлений переполнена, обновление отклонено.")
+            return web.Response(status=503)
+        updates_received.inc()
+        return web.Response()
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain")
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            queued_at, data = await self.queue.get()
+            update_queue_wait.observe(loop.time() - queued_at)
+            inflight_updates.inc()
+            try:
+                with update_latency.time():
+                    await self.dp.process_update(types.Update(**data))
+                updates_processed.inc(status="ok")
+            except Exception as e:
+                updates_processed.inc(status="error")
+                logger.exception("Ошибка при обработке обновления: %s", e)
+            finally:
+                inflight_updates.dec()
+                self.queue.task_done()
+
+    async def _startup(self, app: web.Application):
+        if self.on_startup:
+            await self.on_startup(self.dp)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if Config.WEBHOOK_SET_ON_STARTUP:
+            await self.dp.bot.set_webhook(
+                Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET,
+            )
+            logger.info("Webhook зарегистрирован в Telegram.")
+        logger.info("Webhook-сервер запущен, обработчиков: %s, очередь: %s.", self.workers, self.queue.maxsize)
+
+    async def _shutdown(self, app: web.Application):
+        # Дорабатываем уже принятые обновления, затем останавливаем обработчики
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.on_shutdown:
+            await self.on_shutdown(self.dp)
+        await self.dp.bot.session.close()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(Config.WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/health", self.handle_health)
+        app.on_startup.append(self._startup)
+        app.on_shutdown.append(self._shutdown)
+        return app
+
+def run_webhook(dp: Dispatcher, on_startup=None, on_shutdown=None):
+    server = WebhookServer(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    web.run_app(server.create_app(), host=Config.WEBAPP_HOST, port=Config.WEBAPP_PORT)
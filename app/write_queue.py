@@ -0,0 +1,204 @@
+# app/write_queue.py
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import select, delete, update, func, text
+
+from .config import Config
+from .logging_config import redact
+from .database import async_session
+from .models import PendingMemoryWrite
+from .utils import write_core_memory
+
+logger = logging.getLogger(__name__)
+
+# Пространство ключей advisory-блокировок, чтобы записи одного пользователя
+# применял только один обработчик даже при нескольких репликах
+ADVISORY_LOCK_NAMESPACE = 8008
+MAX_BACKOFF_SECONDS = 300
+# Идентификаторы recall фактов выводятся из id записи очереди: повторное применение после
+# сбоя между вставкой и удалением записи не создаёт дубликатов
+RECALL_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "pending_memory_writes")
+
+STATUS_PENDING = "pending"
+STATUS_DEAD = "dead"
+
+class MemoryWriteQueue:
+    """Очередь отложенной записи памяти поверх таблицы pending_memory_writes.
+
+    enqueue сохраняет запись в таблицу и сразу возвращает управление. Фоновая задача
+    раз в flush_interval применяет накопленные записи: подряд идущие recall-факты
+    пользователя векторизуются и вставляются пачкой, core-записи применяются по одной.
+    Порядок записей одного пользователя сохраняется, при ошибке запись и все следующие
+    за ней ждут повтора с экспоненциальной задержкой. Запись, не применённая за max_attempts
+    попыток, не удаляется, а помечается status = 'dead' и больше не блокирует следующие.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = Config.MEMORY_WRITE_FLUSH_INTERVAL,
+        batch_size: int = Config.MEMORY_WRITE_BATCH_SIZE,
+        max_attempts: int = Config.MEMORY_WRITE_MAX_ATTEMPTS,
+        concurrency: int = Config.MEMORY_WRITE_CONCURRENCY,
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.concurrency = max(1, concurrency)
+        self._task = None
+        self._stopping = None
+
+    async def enqueue(self, user_id: int, kind: str, payload: dict) -> None:
+        async with async_session() as session:
+            session.add(PendingMemoryWrite(user_id=user_id, kind=kind, payload=payload))
+            await session.commit()
+        logger.debug("Запись памяти %s поставлена в очередь для пользователя %s.", kind, user_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Очередь отложенной записи памяти запущена.")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+            logger.info("Очередь отложенной записи памяти остановлена.")
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception("Ошибка при применении очереди записи памяти: %s", e)
+
+    async def flush(self) -> int:
+        """Применяет все готовые к записи элементы очереди, возвращает число применённых."""
+        async with async_session() as session:
+            result = await session.execute(
+                select(PendingMemoryWrite.user_id)
+                .where(
+                    PendingMemoryWrite.status == STATUS_PENDING,
+                    PendingMemoryWrite.next_attempt_at <= datetime.utcnow()
+                )
+                .group_by(PendingMemoryWrite.user_id)
+                .order_by(func.min(PendingMemoryWrite.id))
+                .limit(self.batch_size)
+            )
+            user_ids = result.scalars().all()
+        if not user_ids:
+            return 0
+        # Ограничиваем число одновременно применяемых пользователей, иначе их сессии
+        # с блокировками займут весь пул и записи будут ждать соединение до pool_timeout
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def flush_user(user_id: int) -> int:
+            async with semaphore:
+                return await self._flush_user(user_id)
+
+        applied = await asyncio.gather(*(flush_user(user_id) for user_id in user_ids))
+        logger.debug("Применено %s записей памяти для %s пользователей.", sum(applied), len(user_ids))
+        return sum(applied)
+
+    async def _flush_user(self, user_id: int) -> int:
+        async with async_session() as session:
+            locked = await session.execute(
+                text("SELECT pg_try_advisory_xact_lock(:namespace, :user_id)"),
+                {"namespace": ADVISORY_LOCK_NAMESPACE, "user_id": user_id}
+            )
+            if not locked.scalar():
+                return 0
+
+            result = await session.execute(
+                select(PendingMemoryWrite)
+                .where(PendingMemoryWrite.user_id == user_id, PendingMemoryWrite.status == STATUS_PENDING)
+                .order_by(PendingMemoryWrite.id)
+                .limit(self.batch_size)
+            )
+            rows = result.scalars().all()
+            # Первая запись ждёт повтора - следующие за ней тоже ждут, чтобы не нарушить порядок
+            if not rows or rows[0].next_attempt_at > datetime.utcnow():
+                return 0
+
+            done = []
+            for group in self._groups(rows):
+                try:
+                    await self._apply(session, user_id, group[0].kind, group)
+                    done.extend(group)
+                except Exception as e:
+                    await self._retry_later(session, user_id, group, e)
+                    break
+
+            if done:
+                await session.execute(
+                    delete(PendingMemoryWrite).where(PendingMemoryWrite.id.in_([row.id for row in done]))
+                )
+            await session.commit()
+            return len(done)
+
+    @staticmethod
+    def _groups(rows):
+        # Подряд идущие recall-факты применяются одной пачкой, core-записи - по одной
+        for kind, group in groupby(rows, key=lambda row: row.kind):
+            group = list(group)
+            if kind == "recall":
+                yield group
+            else:
+                for row in group:
+                    yield [row]
+
+    async def _apply(self, session, user_id: int, kind: str, rows: list) -> None:
+        if kind == "recall":
+            from .vectorstore import add_recall_memories
+            await add_recall_memories(user_id, [
+                {**row.payload, "id": uuid.uuid5(RECALL_ID_NAMESPACE, str(row.id))} for row in rows
+            ])
+        elif kind == "core":
+            # Core-запись применяется в одной транзакции с удалением записи очереди, поэтому
+            # при сбое до commit она не останется применённой и не продублируется при повторе.
+            # Точка сохранения откатывает только эту запись, если она не удалась
+            payload = rows[0].payload
+            async with session.begin_nested():
+                await write_core_memory(
+                    session, user_id, payload["memory"], payload.get("memory_id"), payload.get("priority")
+                )
+        else:
+            raise ValueError(f"Неизвестный тип записи памяти: {kind}")
+
+    async def _retry_later(self, session, user_id: int, group: list, error: Exception) -> None:
+        ids = [row.id for row in group]
+        attempts = group[0].attempts + 1
+        if attempts >= self.max_attempts:
+            logger.error(
+                "Запись памяти %s пользователя %s не применена за %s попыток и помечена как dead "
+                "(id в pending_memory_writes: %s): %s. Данные: %s",
+                group[0].kind, user_id, attempts, ids, error, redact([row.payload for row in group])
+            )
+            await session.execute(
+                update(PendingMemoryWrite)
+                .where(PendingMemoryWrite.id.in_(ids))
+                .values(attempts=attempts, status=STATUS_DEAD)
+            )
+            return
+        delay = min(2 ** attempts, MAX_BACKOFF_SECONDS)
+        logger.warning(
+            "Ошибка записи памяти %s пользователя %s (попытка %s), повтор через %s с: %s",
+            group[0].kind, user_id, attempts, delay, error
+        )
+        await session.execute(
+            update(PendingMemoryWrite)
+            .where(PendingMemoryWrite.id.in_(ids))
+            .values(attempts=attempts, next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+        )
+
+memory_write_queue = MemoryWriteQueue()
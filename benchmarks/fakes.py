@@ -0,0 +1,136 @@
+# benchmarks/fakes.py
+
+import asyncio
+import hashlib
+import math
+import random
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.utils import count_tokens
+
+class FakeChatModel(BaseChatModel):
+    """Детерминированная замена ChatOpenAI для нагрузочных тестов.
+
+    script - список шагов хода: на шаге i модель вызывает инструменты script[i]
+    (несколько инструментов на шаге - через "+"), после последнего шага отвечает текстом.
+    Каждый вызов ждёт delay секунд, имитируя задержку провайдера.
+    """
+
+    script: List[List[str]] = []
+    delay: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, *, tool_choice: Optional[str] = None, **kwargs):
+        return self.bind(tool_choice=tool_choice)
+
+    def _tool_args(self, name: str, text: str) -> dict:
+        if name == "search_memory":
+            return {"query": text}
+        if name == "save_recall_memory":
+            return {"memory": text, "timestamp": None}
+        if name == "store_core_memory":
+            return {"memory": f"Пользователь писал: {text[:100]}"}
+        return {}
+
+    def _respond(self, messages: List[BaseMessage], tool_choice: Optional[str]) -> ChatResult:
+        self.calls += 1
+        # Номер шага - число ответов модели после последнего сообщения пользователя
+        last_human = max((i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)), default=-1)
+        text = str(messages[last_human].content) if last_human >= 0 else ""
+        step = sum(isinstance(msg, AIMessage) for msg in messages[last_human + 1:])
+
+        if tool_choice != "none" and step < len(self.script):
+            message = AIMessage(content="", tool_calls=[
+                {"name": name, "args": self._tool_args(name, text), "id": f"call_{self.calls}_{i}"}
+                for i, name in enumerate(self.script[step])
+            ])
+        else:
+            message = AIMessage(content=f"Ответ на сообщение: {text[:200]}")
+
+        input_tokens = sum(count_tokens(str(msg.content)) for msg in messages)
+        output_tokens = count_tokens(str(message.content))
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"cache_read": 0},
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, tool_choice=None, **kwargs: Any) -> ChatResult:
+        return self._respond(messages, tool_choice)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tool_choice=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.delay)
+        return self._respond(messages, tool_choice)
+
+class FakeEmbeddings(Embeddings):
+    """Детерминированные эмбеддинги: единичный вектор, зависящий только от текста."""
+
+    def __init__(self, dimensions: int, delay: float = 0.0):
+        self.dimensions = dimensions
+        self.delay = delay
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.delay)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class FakeBot:
+    async def send_chat_action(self, chat_id: int, action: str):
+        return True
+
+class FakeSentMessage:
+    def __init__(self, text: str, delay: float):
+        self.text = text
+        self.delay = delay
+
+    async def edit_text(self, text: str):
+        await asyncio.sleep(self.delay)
+        self.text = text
+        return self
+
+class FakeMessage:
+    """Минимальная замена aiogram Message: то, что используют обработчики бота."""
+
+    def __init__(self, telegram_id: int, text: str, bot: FakeBot, delay: float = 0.0):
+        self.from_user = SimpleNamespace(id=telegram_id, username=f"bench_{telegram_id}")
+        self.chat = SimpleNamespace(id=telegram_id)
+        self.text = text
+        self.bot = bot
+        self.delay = delay
+        self.replies: List[FakeSentMessage] = []
+
+    async def reply(self, text: str):
+        await asyncio.sleep(self.delay)
+        sent = FakeSentMessage(text, self.delay)
+        self.replies.append(sent)
+        return sent
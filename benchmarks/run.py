@@ -0,0 +1,251 @@
+# benchmarks/run.py
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import delete, event, insert
+
+from app import llm
+from app.config import Config
+from app.logging_config import setup_logging
+from .fakes import FakeBot, FakeChatModel, FakeEmbeddings, FakeMessage
+
+logger = logging.getLogger("benchmarks")
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные через движки приложения."""
+
+    def __init__(self, engines):
+        self.count = 0
+        for engine in {id(engine): engine for engine in engines}.values():
+            event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+async def seed_user(user_id: int, history_size: int, recall_size: int, core_size: int):
+    """Наполняет историю, recall и core память синтетического пользователя."""
+    from app.database import async_session
+    from app.models import Message
+    from app.utils import save_core_memory
+    from app.vectorstore import add_recall_memories
+
+    if history_size:
+        now = datetime.utcnow()
+        async with async_session() as session:
+            await session.execute(insert(Message), [
+                {
+                    "user_id": user_id,
+                    "role": "human" if i % 2 == 0 else "bot",
+                    "content": f"Сообщение {i} из истории пользователя {user_id}",
+                    "created_at": now,
+                }
+                for i in range(history_size)
+            ])
+            await session.commit()
+    if recall_size:
+        await add_recall_memories(user_id, [
+            {"memory": f"Факт {i} о пользователе {user_id}", "timestamp": None}
+            for i in range(recall_size)
+        ])
+    for i in range(core_size):
+        await save_core_memory(user_id, f"Ключевой факт {i} о пользователе {user_id}")
+
+async def cleanup_users(user_ids: list):
+    from app.database import async_session
+    from app.models import CoreMemory, Message, PendingMemoryWrite, User
+    from app.vectorstore import get_vectorstores, user_facts_table
+
+    async with async_session() as session:
+        for model in (Message, CoreMemory, PendingMemoryWrite):
+            await session.execute(delete(model).where(model.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.commit()
+    vectorstores = await get_vectorstores()
+    async with vectorstores["engine"].begin() as conn:
+        await conn.execute(delete(user_facts_table).where(user_facts_table.c.user_id.in_(user_ids)))
+
+@lru_cache(maxsize=1)
+def get_dispatcher():
+    from app.handlers.message_handlers import process_turn
+    from app.handlers.user_dispatcher import UserTurnDispatcher
+    # Склейка сообщений добавляет к ходу фиксированную паузу и искажает задержку
+    return UserTurnDispatcher(process_turn, debounce=0, max_wait=0)
+
+async def run_turn(target: str, telegram_id: int, text: str, bot: FakeBot, telegram_delay: float):
+    from app.handlers.message_handlers import process_turn
+    message = FakeMessage(telegram_id, text, bot, delay=telegram_delay)
+    if target == "handler":
+        await get_dispatcher().submit(message)
+    else:
+        await process_turn([message])
+    if not message.replies:
+        raise RuntimeError("Ответ пользователю не отправлен")
+
+async def run_scenario(args, scenario_index: int, history_size: int, recall_size: int, chat_model, embeddings, queries) -> dict:
+    from app.utils import get_or_create_user
+    from app.write_queue import memory_write_queue
+
+    # У каждого сценария свои пользователи, чтобы данные прошлых прогонов не влияли на результат
+    base = args.telegram_id_base + scenario_index * args.users
+    telegram_ids = [base + i for i in range(args.users)]
+    users = [await get_or_create_user(telegram_id, f"bench_{telegram_id}") for telegram_id in telegram_ids]
+    user_ids = [user.id for user in users]
+    core_size = min(recall_size, Config.CORE_MEMORY_MAX_FACTS)
+    for user_id in user_ids:
+        await seed_user(user_id, history_size, recall_size, core_size)
+    logger.info("Сценарий history=%s recall=%s: данные подготовлены.", history_size, recall_size)
+
+    bot = FakeBot()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def user_session(telegram_id: int):
+        nonlocal errors
+        for turn in range(args.turns_per_user):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await run_turn(args.target, telegram_id, f"Сообщение {turn} для теста", bot, args.telegram_delay)
+                    latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors += 1
+                    logger.warning("Ошибка хода пользователя %s: %s", telegram_id, e)
+
+    queries.count = 0
+    llm_calls_before = chat_model.calls
+    embedding_calls_before = embeddings.calls
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(telegram_id) for telegram_id in telegram_ids))
+    wall_seconds = time.perf_counter() - started
+    turn_queries = queries.count
+
+    # Отложенные записи памяти применяются после замера, их запросы считаются отдельно
+    queries.count = 0
+    while await memory_write_queue.flush():
+        pass
+    write_queries = queries.count
+
+    turns = len(latencies)
+    result = {
+        "history_size": history_size,
+        "recall_size": recall_size,
+        "core_size": core_size,
+        "turns": turns,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "turns_per_second": round(turns / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "mean": round(sum(latencies) / turns * 1000, 1) if turns else 0.0,
+            "max": round(max(latencies, default=0) * 1000, 1),
+        },
+        "db_queries_per_turn": round(turn_queries / turns, 2) if turns else 0.0,
+        "write_queue_queries_per_turn": round(write_queries / turns, 2) if turns else 0.0,
+        "llm_calls_per_turn": round((chat_model.calls - llm_calls_before) / turns, 2) if turns else 0.0,
+        "embedding_calls_per_turn": round((embeddings.calls - embedding_calls_before) / turns, 2) if turns else 0.0,
+    }
+    if not args.keep_data:
+        await cleanup_users(user_ids)
+    logger.info("Сценарий history=%s recall=%s: %s", history_size, recall_size, json.dumps(result, ensure_ascii=False))
+    return result
+
+async def run(args) -> dict:
+    chat_model = FakeChatModel(
+        script=[step.split("+") for step in args.script.split(",") if step],
+        delay=args.llm_delay,
+    )
+    embeddings = FakeEmbeddings(Config.EMBEDDING_DIMENSIONS, delay=args.embedding_delay)
+    # Модули приложения берут клиентов провайдера при импорте, поэтому замены ставятся до них
+    llm.get_llm = lambda: chat_model
+    llm.create_embeddings = lambda: embeddings
+
+    from app.database import engine, get_vector_engine
+    from app.vectorstore import get_vectorstores
+
+    await get_vectorstores()
+    queries = QueryCounter([engine, get_vector_engine()])
+
+    scenarios = []
+    sizes = itertools.product(args.history_sizes, args.recall_sizes)
+    for index, (history_size, recall_size) in enumerate(sizes):
+        scenarios.append(
+            await run_scenario(args, index, history_size, recall_size, chat_model, embeddings, queries)
+        )
+
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "parameters": {
+            "target": args.target,
+            "users": args.users,
+            "turns_per_user": args.turns_per_user,
+            "concurrency": args.concurrency,
+            "script": args.script,
+            "llm_delay": args.llm_delay,
+            "embedding_delay": args.embedding_delay,
+            "telegram_delay": args.telegram_delay,
+            "stream_responses": Config.STREAM_RESPONSES,
+            "memory_write_behind": Config.MEMORY_WRITE_BEHIND,
+            "history_limit": Config.HISTORY_LIMIT,
+            "context_max_tokens": Config.CONTEXT_MAX_TOKENS,
+            "db_pool_size": Config.DB_POOL_SIZE,
+        },
+        "scenarios": scenarios,
+    }
+
+def int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный тест бота на локальной базе с детерминированными заменами OpenAI и Telegram."
+    )
+    parser.add_argument("--target", choices=["handler", "turn"], default="handler",
+                        help="handler - через очередь ходов пользователя (без паузы склейки), turn - напрямую process_turn.")
+    parser.add_argument("--users", type=int, default=20, help="Число синтетических пользователей.")
+    parser.add_argument("--turns-per-user", type=int, default=5, help="Ходов на пользователя, выполняются последовательно.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Сколько ходов выполняется одновременно.")
+    parser.add_argument("--script", default="search_memory,save_recall_memory+store_core_memory",
+                        help="Вызовы инструментов по шагам агента: шаги через запятую, инструменты шага через +.")
+    parser.add_argument("--llm-delay", type=float, default=0.3, help="Задержка одного вызова LLM, с.")
+    parser.add_argument("--embedding-delay", type=float, default=0.05, help="Задержка одного запроса эмбеддингов, с.")
+    parser.add_argument("--telegram-delay", type=float, default=0.05, help="Задержка отправки сообщения в Telegram, с.")
+    parser.add_argument("--history-sizes", type=int_list, default=[0, 100, 1000],
+                        help="Размеры истории сообщений пользователя через запятую.")
+    parser.add_argument("--recall-sizes", type=int_list, default=[0, 1000],
+                        help="Число recall фактов пользователя через запятую (core - не больше CORE_MEMORY_MAX_FACTS).")
+    parser.add_argument("--telegram-id-base", type=int, default=2_000_000_000,
+                        help="Первый telegram_id синтетических пользователей.")
+    parser.add_argument("--keep-data", action="store_true", help="Не удалять данные синтетических пользователей.")
+    parser.add_argument("--output", help="Файл для результатов в JSON (по умолчанию - stdout).")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging(level=args.log_level)
+    logger.setLevel(logging.INFO)
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()